@@ -10,9 +10,9 @@ def render():
     from src.archiefassistent.extraction import save_uploaded_files, walk_files, extract_text, sha256_file
     from src.archiefassistent.schemas import FileTechnical, model_to_dict
     from src.archiefassistent.db import create_job, set_job_total_files, update_job_status, increment_job_files_done
-    from src.archiefassistent.db import save_preprocess_file, save_preprocess_chunk
+    from src.archiefassistent.db import save_preprocess_file, save_preprocess_chunk, record_llm_call
     from src.archiefassistent.chunking import chunk_text_with_spans
-    from src.archiefassistent.ollama_client import ensure_ollama_ready, list_ollama_models, _ollama_embed
+    from src.archiefassistent.ollama_client import ensure_ollama_ready, list_ollama_models, embed_many
 
     render_header()
     st.header("Preprocess files (chunk + embed)")
@@ -70,8 +70,8 @@ def render():
             }
         }
 
-        job_id = create_job(job_name, str(upload_dir), model_tag=DEFAULT_MODEL, options=job_options)
-        update_job_status(job_id, "preprocessing")
+        # Created directly as "preprocessing" so no worker can claim it
+        job_id = create_job(job_name, str(upload_dir), model_tag=DEFAULT_MODEL, options=job_options, status="preprocessing")
 
         files = walk_files(upload_dir)
         set_job_total_files(job_id, len(files))
@@ -107,10 +107,15 @@ def render():
                     overlap=int(sum_overlap),
                     max_chunks=int(sum_max_chunks),
                 )
-                for idx, (stc, endc, ch) in enumerate(sum_chunks):
-                    emb = None
-                    if embed_summary_chunks:
-                        emb = _ollama_embed(ch, model=embed_model, timeout_s=int(timeout_s))
+                # embedding token/timing stats (incl. model loads) per file
+                record_usage = lambda usage, name=fp.name: record_llm_call(job_id, name, None, usage)
+
+                sum_vecs = [None] * len(sum_chunks)
+                if embed_summary_chunks:
+                    sum_vecs = embed_many(
+                        [ch for _, _, ch in sum_chunks], model=embed_model, timeout_s=int(timeout_s), on_usage=record_usage
+                    )
+                for idx, ((stc, endc, ch), emb) in enumerate(zip(sum_chunks, sum_vecs)):
                     save_preprocess_chunk(
                         job_id=job_id,
                         preprocess_file_id=preprocess_file_id,
@@ -130,8 +135,10 @@ def render():
                     overlap=int(emb_overlap),
                     max_chunks=int(emb_max_chunks),
                 )
-                for idx, (stc, endc, ch) in enumerate(emb_chunks):
-                    vec = _ollama_embed(ch, model=embed_model, timeout_s=int(timeout_s))
+                emb_vecs = embed_many(
+                    [ch for _, _, ch in emb_chunks], model=embed_model, timeout_s=int(timeout_s), on_usage=record_usage
+                )
+                for idx, ((stc, endc, ch), vec) in enumerate(zip(emb_chunks, emb_vecs)):
                     save_preprocess_chunk(
                         job_id=job_id,
                         preprocess_file_id=preprocess_file_id,
@@ -2,6 +2,7 @@ def render():
     from datetime import datetime
     from pathlib import Path
     import json
+    import time
 
     import streamlit as st
     import streamlit.components.v1 as components
@@ -9,10 +10,11 @@ def render():
     from streamlit_monaco import st_monaco
 
     from src.archiefassistent.ui.layout import render_header
-    from src.archiefassistent.config import DEFAULT_MODEL, SUPPORTED_EXTS, UPLOADS_DIR
+    from src.archiefassistent.config import DEFAULT_MODEL, SUPPORTED_EXTS, UPLOADS_DIR, OLLAMA_KEEP_ALIVE
     from src.archiefassistent.extraction import save_uploaded_files, walk_files
-    from src.archiefassistent.db import create_job, set_job_total_files
-    from src.archiefassistent.ollama_client import ensure_ollama_ready, list_ollama_models, generate_json_schema, DEFAULT_SCHEMA
+    from src.archiefassistent.db import create_job, set_job_total_files, get_job, cancel_queued_job
+    from src.archiefassistent.ollama_client import ensure_ollama_ready, list_ollama_models, cached_json_schema, generate_json_schema, backend_status, DEFAULT_SCHEMA
+    from src.archiefassistent.aggregation import default_stop_fields, default_escalation_fields
 
     render_header()
 
@@ -26,6 +28,11 @@ def render():
     )
 
     model_tag = st.text_input("Ollama model", value=DEFAULT_MODEL)
+    escalation_model = st.text_input(
+        "Escalation model (optional)",
+        value="",
+        help="Larger model that re-extracts only the fields the first model left missing, invalid or conflicting",
+    )
     job_name_default = f"job-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
     job_name = st.text_input("Job name", value=job_name_default)
 
@@ -33,9 +40,36 @@ def render():
     # but you can wire them into jobs.process_job later.
     max_files = st.number_input("Max files to process", min_value=1, max_value=5000, value=200)
     request_timeout = st.number_input("Model timeout (s)", min_value=30, max_value=600, value=180)
-    chunk_size = st.number_input("Chunk size (chars)", min_value=400, max_value=120000, value=2200, step=200)
+    chunk_size = st.number_input(
+        "Chunk size (chars)",
+        min_value=400,
+        max_value=120000,
+        value=2200,
+        step=200,
+        help="Capped by the worker at what fits in the largest model context",
+    )
     chunk_overlap = st.number_input("Chunk overlap (chars)", min_value=0, max_value=1000, value=150, step=25)
     max_chunks = st.number_input("Max chunks per file", min_value=1, max_value=20, value=5)
+    extract_workers = st.number_input("Text extraction processes (1 = sequential)", min_value=1, max_value=32, value=1)
+    llm_concurrency = st.number_input("Parallel model requests (match OLLAMA_NUM_PARALLEL)", min_value=1, max_value=32, value=1)
+    extraction_mode = st.selectbox(
+        "Extraction mode",
+        options=["chunks", "retrieval"],
+        help="retrieval: use preprocess embeddings to send only the chunks most relevant to each schema field",
+    )
+    retrieval_top_k = st.number_input("Retrieval: chunks per field (top-k)", min_value=1, max_value=20, value=3)
+    early_stop = st.checkbox("Stop calling the model once the required fields are filled", value=False)
+    stream = st.checkbox("Stream model output (keeps partial results on timeout)", value=False)
+    keep_alive = st.text_input("Keep model loaded between requests (Ollama keep_alive)", value=OLLAMA_KEEP_ALIVE)
+    pack_max_chars = st.number_input(
+        "Pack small files: max chars per file (0 = off)",
+        min_value=0,
+        max_value=5000,
+        value=0,
+        step=100,
+        help="Files with at most this much text (and at most the chunk size) are sent several at a time in one model request",
+    )
+    pack_max_docs = st.number_input("Pack small files: files per request", min_value=2, max_value=20, value=6)
 
     job_options = {
         "max_files": int(max_files),
@@ -43,12 +77,23 @@ def render():
         "chunk_size": int(chunk_size),
         "chunk_overlap": int(chunk_overlap),
         "max_chunks": int(max_chunks),
+        "extract_workers": int(extract_workers),
+        "llm_concurrency": int(llm_concurrency),
+        "extraction_mode": extraction_mode,
+        "retrieval_top_k": int(retrieval_top_k),
+        "early_stop": bool(early_stop),
+        "stream": bool(stream),
+        "keep_alive": keep_alive.strip() or OLLAMA_KEEP_ALIVE,
+        "escalation_model": escalation_model.strip(),
+        "pack_max_chars": int(pack_max_chars),
+        "pack_max_docs": int(pack_max_docs),
     }
 
     with st.expander("Diagnostics: Ollama connectivity"):
         ok = ensure_ollama_ready(model_tag, timeout_s=4)
         st.write("Model available:" , "✅" if ok else "❌")
         st.write("Models:", list_ollama_models(timeout_s=4) or ["(none / not reachable)"])
+        st.write("Backends:", backend_status())
     
     # --- Schema builder UI ---
     st.subheader("Extractie schema")
@@ -71,16 +116,57 @@ def render():
     with colB:
         st.caption("Je kunt het schema hieronder aanpassen. Het moet wel valide JSON zijn.")
 
-    # When user clicks generate
+    # When user clicks generate: a cached schema for this description is shown
+    # right away, otherwise the worker generates it and we poll for the result.
+    # If no worker picks the job up within a few seconds, generate it here.
+    schema_claim_timeout_s = 5
     if generate_schema:
-        # call your LLM to generate a JSON Schema
-        # We'll define `generate_json_schema(...)` below
-        try:
-            generated = generate_json_schema(model=model_tag, description=schema_desc)
-            st.session_state.schema_text = json.dumps(generated, ensure_ascii=False, indent=2)
+        cached = cached_json_schema(model_tag, schema_desc)
+        if cached:
+            st.session_state.schema_text = json.dumps(cached, ensure_ascii=False, indent=2)
+            st.session_state.schema_job_id = None
+            st.success("Schema gegenereerd (uit cache). Bekijk en bewerk het hieronder.")
+        else:
+            st.session_state.schema_job_id = create_job(
+                f"schema-{datetime.now().strftime('%Y%m%d-%H%M%S')}",
+                "",
+                model_tag,
+                options={"description": schema_desc},
+                kind="schema",
+            )
+            st.session_state.schema_job_queued_at = time.time()
+
+    schema_job_id = st.session_state.get("schema_job_id")
+    if schema_job_id is not None:
+        schema_job = get_job(schema_job_id) or {}
+        status = schema_job.get("status") or "missing"
+        waited = time.time() - st.session_state.get("schema_job_queued_at", time.time())
+        if status == "queued" and waited > schema_claim_timeout_s and cancel_queued_job(schema_job_id):
+            st.session_state.schema_job_id = None
+            try:
+                with st.spinner("Geen worker beschikbaar; schema wordt hier gegenereerd..."):
+                    generated = generate_json_schema(model=model_tag, description=schema_job["options"].get("description") or "")
+                st.session_state.schema_text = json.dumps(generated, ensure_ascii=False, indent=2)
+                st.success("Schema gegenereerd. Bekijk en bewerk het hieronder.")
+            except Exception as e:
+                st.error(f"Failed to generate schema: {e}")
+        elif status == "finished" and isinstance(schema_job.get("result"), dict):
+            st.session_state.schema_text = json.dumps(schema_job["result"], ensure_ascii=False, indent=2)
+            st.session_state.schema_job_id = None
             st.success("Schema gegenereerd. Bekijk en bewerk het hieronder.")
-        except Exception as e:
-            st.error(f"Failed to generate schema: {e}")
+        elif status in ("queued", "running"):
+            @st.fragment(run_every=2)
+            def _wait_for_schema():
+                current = (get_job(schema_job_id) or {}).get("status")
+                unclaimed = current == "queued" and time.time() - st.session_state.get("schema_job_queued_at", 0) > schema_claim_timeout_s
+                if current not in ("queued", "running") or unclaimed:
+                    st.rerun()
+                st.info(f"Schema wordt gegenereerd door de worker (job {schema_job_id}, {current})...")
+
+            _wait_for_schema()
+        else:
+            st.session_state.schema_job_id = None
+            st.error(f"Failed to generate schema: {status}")
     
     schema_text = st_ace(
         value=st.session_state.schema_text,
@@ -109,6 +195,21 @@ def render():
     if schema_obj:
         job_options["schema"] = schema_obj
 
+        if early_stop and isinstance(schema_obj.get("properties"), dict):
+            job_options["early_stop_fields"] = st.multiselect(
+                "Early stop: fields that must be filled",
+                options=list(schema_obj["properties"].keys()),
+                default=default_stop_fields(schema_obj),
+            )
+
+        if escalation_model.strip() and isinstance(schema_obj.get("properties"), dict):
+            job_options["escalation_must_fill"] = st.multiselect(
+                "Escalation: fields that must be filled",
+                options=[k for k in schema_obj["properties"] if k not in ("technical", "filetype")],
+                default=default_escalation_fields(schema_obj),
+                help="Empty fields from this list are re-extracted with the escalation model",
+            )
+
     can_queue = (schema_error is None)
 
     if uploaded:
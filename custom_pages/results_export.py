@@ -12,6 +12,8 @@ def render():
         update_record_db,
         delete_job,
         get_job,
+        get_job_llm_stats,
+        get_file_llm_stats,
     )
 
     render_header()
@@ -205,6 +207,20 @@ def render():
         st.error("Schema has no properties; cannot build results table.")
         st.stop()
 
+    # ----------------------------
+    # Model usage (tokens / time per job and per file)
+    # ----------------------------
+    usage = get_job_llm_stats(job_id)
+    if usage.get("calls"):
+        with st.expander("Model usage", expanded=False):
+            c1, c2, c3, c4 = st.columns(4)
+            c1.metric("Calls", f"{usage['calls']} ({usage.get('cached_calls') or 0} cached)")
+            c2.metric("Tokens in / out", f"{usage.get('prompt_tokens') or 0} / {usage.get('output_tokens') or 0}")
+            c3.metric("Compute s", f"{usage.get('compute_s') or 0:.1f}")
+            c4.metric("Waiting s", f"{usage.get('waiting_s') or 0:.1f}")
+            st.json(usage, expanded=False)
+            st.dataframe(pd.DataFrame(get_file_llm_stats(job_id)), use_container_width=True)
+
     # ----------------------------
     # Load records for this job
     # ----------------------------
@@ -0,0 +1,411 @@
+# mock_ollama.py
+"""
+Fake Ollama server for load tests without a GPU or network.
+
+Implements /api/generate (plain and streaming), /api/embed, /api/embeddings
+and /api/tags. Generate answers are shaped after the request's "format"
+schema; embeddings are deterministic per text. Latency, errors, hanging
+requests, model loads and Ollama's parallelism/queue limits are configurable.
+GET /api/ps lists loaded models; GET /mock/stats returns request counters.
+
+    python mock_ollama.py --port 11435 --latency 0.8 --latency-dist lognormal --error-rate 0.05 --parallel 2
+    ARCHIEF_OLLAMA_BACKENDS=http://127.0.0.1:11435 python worker.py
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+
+class MockConfig:
+    def __init__(
+        self,
+        *,
+        models: Optional[List[str]] = None,
+        latency_s: float = 0.2,
+        latency_sd_s: float = 0.1,
+        latency_dist: str = "fixed",
+        tokens_per_s: float = 0.0,
+        load_s: float = 0.0,
+        max_loaded: int = 0,
+        error_rate: float = 0.0,
+        error_codes: Optional[List[int]] = None,
+        timeout_rate: float = 0.0,
+        hang_s: float = 600.0,
+        parallel: int = 4,
+        max_queue: int = 512,
+        embed_dim: int = 384,
+        seed: Optional[int] = None,
+    ):
+        self.models = models or ["llama3.2:3b", "qwen3-embedding:0.6b"]
+        self.latency_s = float(latency_s)
+        self.latency_sd_s = float(latency_sd_s)
+        self.latency_dist = latency_dist
+        self.tokens_per_s = float(tokens_per_s)
+        self.load_s = float(load_s)
+        self.max_loaded = max(0, int(max_loaded))   # 0 = unlimited (OLLAMA_MAX_LOADED_MODELS)
+        self.error_rate = float(error_rate)
+        self.error_codes = error_codes or [500, 503]
+        self.timeout_rate = float(timeout_rate)
+        self.hang_s = float(hang_s)
+        self.parallel = max(1, int(parallel))
+        self.max_queue = max(0, int(max_queue))
+        self.embed_dim = max(1, int(embed_dim))
+        self.rng = random.Random(seed)
+
+
+class MockOllama:
+    """State shared by all handler threads: config, run slots, loaded models and counters."""
+
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self._slots = threading.BoundedSemaphore(config.parallel)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._loaded: Dict[str, int] = {}   # model -> num_ctx it was loaded with
+        self.stats: Dict[str, Any] = {
+            "requests": 0, "generate": 0, "embed": 0, "errors": 0, "hangs": 0,
+            "rejected": 0, "loads": 0, "in_flight": 0, "max_in_flight": 0,
+        }
+
+    # -----------------------
+    # Simulation
+    # -----------------------
+
+    def _rand(self) -> float:
+        with self._lock:
+            return self.config.rng.random()
+
+    def sample_latency(self) -> float:
+        c = self.config
+        with self._lock:
+            rng = c.rng
+            if c.latency_dist == "uniform":
+                v = rng.uniform(max(0.0, c.latency_s - c.latency_sd_s), c.latency_s + c.latency_sd_s)
+            elif c.latency_dist == "exp":
+                v = rng.expovariate(1.0 / c.latency_s) if c.latency_s > 0 else 0.0
+            elif c.latency_dist == "lognormal" and c.latency_s > 0:
+                # parameters chosen so mean/sd match latency_s/latency_sd_s
+                var = math.log(1 + (c.latency_sd_s / c.latency_s) ** 2)
+                v = rng.lognormvariate(math.log(c.latency_s) - var / 2, math.sqrt(var))
+            else:
+                v = c.latency_s
+        return max(0.0, v)
+
+    def model_load(self, model: str, num_ctx: int) -> float:
+        """
+        Seconds spent loading: first use of a model, a num_ctx change, or a model
+        that was evicted because max_loaded other models were in use (like Ollama).
+        """
+        with self._lock:
+            if self._loaded.get(model) == num_ctx:
+                self._loaded[model] = self._loaded.pop(model)   # most recently used last
+                return 0.0
+            self._loaded.pop(model, None)
+            while self.config.max_loaded and len(self._loaded) >= self.config.max_loaded:
+                self._loaded.pop(next(iter(self._loaded)))
+            self._loaded[model] = num_ctx
+            self.stats["loads"] += 1
+        return self.config.load_s
+
+    def loaded(self) -> List[str]:
+        with self._lock:
+            return list(self._loaded)
+
+    def count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self.stats[key] = self.stats.get(key, 0) + n
+
+    def enter(self) -> bool:
+        """Take a run slot (queueing like Ollama); False if the queue is full."""
+        with self._lock:
+            if self._waiting >= self.config.max_queue and self.stats["in_flight"] >= self.config.parallel:
+                self.stats["rejected"] += 1
+                return False
+            self._waiting += 1
+        self._slots.acquire()
+        with self._lock:
+            self._waiting -= 1
+            self.stats["in_flight"] += 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+        return True
+
+    def leave(self) -> None:
+        with self._lock:
+            self.stats["in_flight"] -= 1
+        self._slots.release()
+
+    # -----------------------
+    # Fake content
+    # -----------------------
+
+    def embedding(self, text: str) -> List[float]:
+        """Deterministic unit vector per text (same text -> same vector)."""
+        out: List[float] = []
+        counter = 0
+        while len(out) < self.config.embed_dim:
+            h = hashlib.sha256(f"{counter}\0{text}".encode("utf-8")).digest()
+            out.extend((b - 127.5) / 127.5 for b in h)
+            counter += 1
+        vec = out[: self.config.embed_dim]
+        n = math.sqrt(sum(x * x for x in vec)) or 1.0
+        return [x / n for x in vec]
+
+
+def _fake_value(schema: Any, key: str, depth: int = 0) -> Any:
+    """A plausible value for a JSON schema node."""
+    schema = schema if isinstance(schema, dict) else {}
+    t = schema.get("type")
+    if isinstance(t, list):
+        t = next((x for x in t if x != "null"), "string")
+    if "enum" in schema and schema["enum"]:
+        return schema["enum"][0]
+    if t == "object" or (t is None and isinstance(schema.get("properties"), dict)):
+        if depth > 3:
+            return {}
+        props = schema.get("properties") or {}
+        return {k: _fake_value(v, k, depth + 1) for k, v in props.items()}
+    if t == "array":
+        return [_fake_value(schema.get("items"), key, depth + 1) for _ in range(2)]
+    if t == "integer":
+        return 1990
+    if t == "number":
+        return 1.5
+    if t == "boolean":
+        return False
+    if "date" in key:
+        return "1990-01-01"
+    return f"mock {key}"
+
+
+def _fake_response(payload: Dict[str, Any]) -> str:
+    fmt = payload.get("format")
+    docs = ((fmt or {}).get("properties") or {}).get("documents") if isinstance(fmt, dict) else None
+    if isinstance(docs, dict) and "doc_id" in ((docs.get("items") or {}).get("properties") or {}):
+        # multi-document request: one record per "### doc_id: X" block in the prompt
+        ids = re.findall(r"^### doc_id: (\S+)", payload.get("prompt") or "", re.MULTILINE)
+        records = [dict(_fake_value(docs["items"], "document"), doc_id=i) for i in ids]
+        return json.dumps({"documents": records}, ensure_ascii=False)
+    if isinstance(fmt, dict):
+        return json.dumps(_fake_value(fmt, "root"), ensure_ascii=False)
+    if fmt == "json":
+        # schema generation asks for a JSON schema in json mode
+        return json.dumps({
+            "type": "object",
+            "properties": {"title": {"type": "string", "description": "Titel"}},
+            "required": ["title"],
+        })
+    return "mock response"
+
+
+def _make_handler(mock: MockOllama):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+        def _send(self, obj: Any, status: int = 200) -> None:
+            body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self) -> None:
+            if self.path.startswith("/api/tags"):
+                return self._send({"models": [{"name": m, "model": m} for m in mock.config.models]})
+            if self.path.startswith("/api/ps"):
+                return self._send({"models": [{"name": m, "model": m} for m in mock.loaded()]})
+            if self.path.startswith("/mock/stats"):
+                return self._send(dict(mock.stats))
+            self._send({"error": "not found"}, 404)
+
+        def do_POST(self) -> None:
+            n = int(self.headers.get("Content-Length") or 0)
+            try:
+                payload = json.loads(self.rfile.read(n) or b"{}")
+            except Exception:
+                return self._send({"error": "invalid JSON"}, 400)
+            mock.count("requests")
+
+            routes = {
+                "/api/generate": self._generate,
+                "/api/embed": self._embed,
+                "/api/embeddings": self._embeddings,
+            }
+            route = routes.get(self.path.split("?")[0])
+            if route is None:
+                return self._send({"error": "not found"}, 404)
+            model = payload.get("model")
+            if model not in mock.config.models:
+                return self._send({"error": f"model '{model}' not found"}, 404)
+
+            # injected failures
+            if mock._rand() < mock.config.timeout_rate:
+                mock.count("hangs")
+                time.sleep(mock.config.hang_s)
+                return self._send({"error": "mock hang"}, 500)
+            if mock._rand() < mock.config.error_rate:
+                mock.count("errors")
+                code = mock.config.error_codes[int(mock._rand() * len(mock.config.error_codes))]
+                return self._send({"error": f"mock error {code}"}, code)
+
+            if not mock.enter():
+                return self._send({"error": "server busy, please try again. maximum pending requests exceeded"}, 503)
+            try:
+                route(payload)
+            finally:
+                mock.leave()
+
+        def _generate(self, payload: Dict[str, Any]) -> None:
+            mock.count("generate")
+            opts = payload.get("options") or {}
+            load_s = mock.model_load(payload["model"], int(opts.get("num_ctx") or 2048))
+            text = _fake_response(payload)
+            done_reason = "stop"
+            # like Ollama: the answer is cut off after num_predict tokens
+            max_tokens = int(opts.get("num_predict") or 0)
+            if max_tokens > 0 and len(text) > max_tokens * 4:
+                text, done_reason = text[: max_tokens * 4], "length"
+            prompt_tokens = len(payload.get("prompt") or "") // 4 + 1
+            eval_tokens = len(text) // 4 + 1
+            latency = mock.sample_latency()
+            if mock.config.tokens_per_s > 0:
+                latency += eval_tokens / mock.config.tokens_per_s
+            time.sleep(load_s)
+
+            stats = {
+                "model": payload["model"],
+                "done": True,
+                "done_reason": done_reason,
+                "prompt_eval_count": prompt_tokens,
+                "eval_count": eval_tokens,
+                "load_duration": int(load_s * 1e9),
+                "prompt_eval_duration": int(latency * 0.2 * 1e9),
+                "eval_duration": int(latency * 0.8 * 1e9),
+                "total_duration": int((latency + load_s) * 1e9),
+            }
+            if not payload.get("stream", True):
+                time.sleep(latency)
+                return self._send(dict(stats, response=text))
+
+            # NDJSON stream, pieces spread over the latency
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            pieces = [text[i:i + 8] for i in range(0, len(text), 8)] or [""]
+            try:
+                for piece in pieces:
+                    time.sleep(latency / len(pieces))
+                    self._chunk({"model": payload["model"], "response": piece, "done": False})
+                self._chunk(dict(stats, response=""))
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass   # client stopped reading early
+
+        def _chunk(self, obj: Dict[str, Any]) -> None:
+            line = (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+            self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+            self.wfile.flush()
+
+        def _embed(self, payload: Dict[str, Any]) -> None:
+            inp = payload.get("input")
+            texts = inp if isinstance(inp, list) else [inp or ""]
+            mock.count("embed")
+            load_s = mock.model_load(payload["model"], 0)
+            latency = mock.sample_latency() * 0.1 * len(texts)
+            time.sleep(load_s + latency)
+            self._send({
+                "model": payload["model"],
+                "embeddings": [mock.embedding(str(t)) for t in texts],
+                "prompt_eval_count": sum(len(str(t)) // 4 + 1 for t in texts),
+                "load_duration": int(load_s * 1e9),
+                "total_duration": int((load_s + latency) * 1e9),
+            })
+
+        def _embeddings(self, payload: Dict[str, Any]) -> None:
+            mock.count("embed")
+            load_s = mock.model_load(payload["model"], 0)
+            time.sleep(load_s + mock.sample_latency() * 0.1)
+            self._send({"embedding": mock.embedding(str(payload.get("prompt") or ""))})
+
+    return Handler
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request: Any, client_address: Any) -> None:
+        # clients closing streams early (or timing out) are expected here
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def start_mock_server(host: str = "127.0.0.1", port: int = 0, config: Optional[MockConfig] = None):
+    """Run the mock server in a daemon thread. Returns (server, MockOllama, base_url)."""
+    mock = MockOllama(config or MockConfig())
+    server = _Server((host, int(port)), _make_handler(mock))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, mock, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    p = argparse.ArgumentParser(description="Fake Ollama server for load tests")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=11435)
+    p.add_argument("--models", default="llama3.2:3b,qwen3-embedding:0.6b", help="comma-separated model names")
+    p.add_argument("--latency", type=float, default=0.2, help="mean seconds per request")
+    p.add_argument("--latency-sd", type=float, default=0.1)
+    p.add_argument("--latency-dist", choices=["fixed", "uniform", "exp", "lognormal"], default="fixed")
+    p.add_argument("--tokens-per-s", type=float, default=0.0, help="extra time per output token (0 = off)")
+    p.add_argument("--load-s", type=float, default=0.0, help="model load time on first use / num_ctx change")
+    p.add_argument("--max-loaded", type=int, default=0, help="models kept in memory at once (0 = unlimited)")
+    p.add_argument("--error-rate", type=float, default=0.0)
+    p.add_argument("--error-codes", default="500,503")
+    p.add_argument("--timeout-rate", type=float, default=0.0, help="fraction of requests that hang")
+    p.add_argument("--hang-s", type=float, default=600.0)
+    p.add_argument("--parallel", type=int, default=4, help="requests processed at once (OLLAMA_NUM_PARALLEL)")
+    p.add_argument("--max-queue", type=int, default=512, help="waiting requests before 503 (OLLAMA_MAX_QUEUE)")
+    p.add_argument("--embed-dim", type=int, default=384)
+    p.add_argument("--seed", type=int, default=None)
+    a = p.parse_args()
+
+    config = MockConfig(
+        models=[m.strip() for m in a.models.split(",") if m.strip()],
+        latency_s=a.latency,
+        latency_sd_s=a.latency_sd,
+        latency_dist=a.latency_dist,
+        tokens_per_s=a.tokens_per_s,
+        load_s=a.load_s,
+        max_loaded=a.max_loaded,
+        error_rate=a.error_rate,
+        error_codes=[int(c) for c in a.error_codes.split(",") if c.strip()],
+        timeout_rate=a.timeout_rate,
+        hang_s=a.hang_s,
+        parallel=a.parallel,
+        max_queue=a.max_queue,
+        embed_dim=a.embed_dim,
+        seed=a.seed,
+    )
+    server, mock, url = start_mock_server(a.host, a.port, config)
+    print(f"[mock-ollama] listening on {url} (models: {', '.join(config.models)})")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"[mock-ollama] {mock.stats}")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
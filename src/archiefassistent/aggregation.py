@@ -1,7 +1,7 @@
 from __future__ import annotations
 import json
 import re
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 # -----------------------
 # Schema/type helpers
@@ -14,6 +14,10 @@ def _schema_type(prop_schema: Dict[str, Any]) -> str:
         return nn[0] if nn else "string"
     return t or "string"
 
+def _schema_nullable(prop_schema: Dict[str, Any]) -> bool:
+    t = (prop_schema or {}).get("type")
+    return (isinstance(t, list) and "null" in t) or t == "null" or None in ((prop_schema or {}).get("enum") or [])
+
 def _schema_items_schema(prop_schema: Dict[str, Any]) -> Dict[str, Any]:
     items = (prop_schema or {}).get("items")
     return items if isinstance(items, dict) else {}
@@ -26,15 +30,21 @@ def _schema_properties(schema: Dict[str, Any]) -> Dict[str, Any]:
     props = (schema or {}).get("properties")
     return props if isinstance(props, dict) else {}
 
+# String fields that are concatenated across chunks instead of first-wins
+CONCAT_KEYS = ("description", "samenvatting", "abstract", "notes")
+
+def _is_empty(v: Any) -> bool:
+    if v is None:
+        return True
+    if isinstance(v, str) and not v.strip():
+        return True
+    if isinstance(v, (list, dict)) and len(v) == 0:
+        return True
+    return False
+
 def _first_non_empty(values: List[Any]) -> Any:
     for v in values:
-        if v is None:
-            continue
-        if isinstance(v, str) and not v.strip():
-            continue
-        if isinstance(v, list) and len(v) == 0:
-            continue
-        if isinstance(v, dict) and len(v) == 0:
+        if _is_empty(v):
             continue
         return v
     return None
@@ -196,13 +206,16 @@ def _coerce_to_list(v: Any) -> List[Any]:
         return [s]
     return []
 
-def _merge_array_of_objects(values: List[Any], items_schema: Dict[str, Any]) -> List[Dict[str, Any]]:
+def _merge_array_of_objects(
+    values: List[Any], items_schema: Dict[str, Any], keys: Optional[List[str]] = None
+) -> List[Dict[str, Any]]:
     """
     Merge lists of dicts from multiple chunks:
-    - dedupe by schema-derived signature keys
+    - dedupe by schema-derived signature keys (pass `keys` if already derived)
     - deep-merge duplicates to fill missing subfields
     """
-    keys = _derive_identity_keys(items_schema)
+    if keys is None:
+        keys = _derive_identity_keys(items_schema)
 
     merged_by_sig: Dict[str, Dict[str, Any]] = {}
     order: List[str] = []
@@ -236,13 +249,254 @@ def _merge_array_of_scalars(values: List[Any]) -> List[Any]:
 
     return out
 
-def _merge_arrays(values: List[Any], items_schema: Dict[str, Any]) -> List[Any]:
+# -----------------------
+# Completeness (early stop)
+# -----------------------
+
+def default_stop_fields(schema: Any) -> List[str]:
     """
-    If items are objects (per schema), merge as objects; otherwise merge as scalars.
+    Required top-level fields that must be non-empty before early stop: minus
+    concat fields (they only ever grow), metadata filled locally, and fields
+    allowed to stay empty (nullable, arrays) - see default_escalation_fields.
     """
-    if _schema_type(items_schema) == "object":
-        return _merge_array_of_objects(values, items_schema)
-    return _merge_array_of_scalars(values)
+    return [k for k in default_escalation_fields(schema) if k not in CONCAT_KEYS]
+
+def missing_fields(record: Dict[str, Any], fields: List[str]) -> List[str]:
+    return [k for k in fields if _is_empty(record.get(k))]
+
+def invalid_fields(record: Dict[str, Any], cs: "CompiledSchema") -> List[str]:
+    """Fields whose value breaks the schema's enum/format/pattern constraints."""
+    return [k for k, check in cs.checks.items() if not _is_empty(record.get(k)) and not check(record.get(k))]
+
+def conflicting_fields(chunk_dicts: List[Dict[str, Any]], cs: "CompiledSchema") -> List[str]:
+    """Single-valued fields (first-wins scalars) for which chunks gave different answers."""
+    out: List[str] = []
+    for key, t in cs.types.items():
+        if t not in ("string", "integer", "number", "boolean") or key in CONCAT_KEYS:
+            continue
+        seen = {_norm_scalar(d.get(key)) for d in chunk_dicts if not _is_empty(d.get(key))}
+        if len(seen) > 1:
+            out.append(key)
+    return out
+
+# Filled from file metadata, never re-queried
+_METADATA_KEYS = ("technical", "filetype")
+
+def default_escalation_fields(schema: Any) -> List[str]:
+    """
+    Required fields the schema doesn't allow to be empty: not nullable and not
+    arrays (an empty list is a valid answer). Generated schemas mark every field
+    required, so "required" alone would escalate nearly every file.
+    """
+    cs = compile_schema(schema)
+    return [
+        k for k in cs.required
+        if k in cs.props and k not in cs.nullable and cs.types.get(k) != "array" and k not in _METADATA_KEYS
+    ]
+
+def escalation_fields(
+    record: Dict[str, Any],
+    chunk_dicts: List[Dict[str, Any]],
+    schema: Any,
+    must_fill: Optional[List[str]] = None,
+) -> List[str]:
+    """
+    Fields a larger model should re-extract: missing from must_fill (default:
+    default_escalation_fields), invalid against enum/format/pattern, or
+    conflicting across chunks.
+    """
+    cs = compile_schema(schema)
+    must_fill = default_escalation_fields(cs) if must_fill is None else must_fill
+    failing = [k for k in must_fill if k in cs.props and _is_empty(record.get(k))]
+    failing += invalid_fields(record, cs) + conflicting_fields(chunk_dicts, cs)
+    return [k for k in dict.fromkeys(failing) if k not in _METADATA_KEYS]
+
+# -----------------------
+# Per-property merge/normalize functions
+# -----------------------
+
+def _merge_boolean(values: List[Any]) -> Optional[bool]:
+    v = _first_non_empty(values)
+    if isinstance(v, str):
+        s = v.strip().lower()
+        if s in ("true", "ja", "yes", "1"):
+            return True
+        if s in ("false", "nee", "no", "0"):
+            return False
+        return None
+    return v
+
+def _merge_integer(values: List[Any]) -> Optional[int]:
+    n = _merge_numbers(values, mode="first")
+    if isinstance(n, float):
+        try:
+            return int(n)
+        except Exception:
+            return None
+    return n
+
+def _norm_array(val: Any) -> List[Any]:
+    if isinstance(val, list):
+        return val
+    if isinstance(val, str) and val.strip():
+        return [val.strip()]
+    return []
+
+def _norm_object(val: Any) -> Dict[str, Any]:
+    return val if isinstance(val, dict) else {}
+
+def _norm_boolean(val: Any) -> Optional[bool]:
+    if isinstance(val, bool):
+        return val
+    if isinstance(val, str):
+        return val.strip().lower() in ("true", "ja", "yes", "1")
+    return None
+
+def _norm_number(val: Any) -> Optional[float]:
+    try:
+        return float(val)
+    except Exception:
+        return None
+
+def _norm_integer(val: Any) -> Optional[int]:
+    try:
+        return int(float(val))
+    except Exception:
+        return None
+
+def _norm_string(val: Any) -> Any:
+    return val.strip() if isinstance(val, str) else val
+
+_NORMALIZERS = {
+    "array": _norm_array,
+    "object": _norm_object,
+    "boolean": _norm_boolean,
+    "number": _norm_number,
+    "integer": _norm_integer,
+}
+
+# -----------------------
+# Value validation (enum / format / pattern)
+# -----------------------
+
+_FORMAT_RES = {
+    "date": re.compile(r"^\d{4}-\d{2}-\d{2}$"),
+    "date-time": re.compile(r"^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:?\d{2})?$"),
+    "email": re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$"),
+    "uri": re.compile(r"^[A-Za-z][A-Za-z0-9+.-]*:\S+$"),
+}
+
+def _scalar_check(ps: Dict[str, Any]) -> Optional[Callable[[Any], bool]]:
+    enum = ps.get("enum") if isinstance(ps.get("enum"), list) else None
+    fmt = _FORMAT_RES.get(ps.get("format"))
+    try:
+        pattern = re.compile(ps["pattern"]) if isinstance(ps.get("pattern"), str) else None
+    except re.error:
+        pattern = None
+    if enum is None and fmt is None and pattern is None:
+        return None
+
+    def check(v: Any) -> bool:
+        if enum is not None and v not in enum:
+            return False
+        if isinstance(v, str):
+            if fmt is not None and not fmt.match(v):
+                return False
+            if pattern is not None and not pattern.search(v):
+                return False
+        return True
+    return check
+
+def _value_check(ps: Dict[str, Any]) -> Optional[Callable[[Any], bool]]:
+    """Validator for a property's value (arrays: every item), or None if unconstrained."""
+    if _schema_type(ps) == "array":
+        item_check = _scalar_check(_schema_items_schema(ps))
+        if item_check is None:
+            return None
+        return lambda v: not isinstance(v, list) or all(_is_empty(x) or item_check(x) for x in v)
+    return _scalar_check(ps)
+
+# -----------------------
+# Compiled schema
+# -----------------------
+
+class CompiledSchema:
+    """
+    Per-property normalizers and merge functions derived once from a JSON
+    schema (types, concat fields, array identity keys), so the per-chunk
+    normalization and per-file aggregation don't re-walk the schema.
+    Build one per job with compile_schema() and pass it along.
+    """
+
+    def __init__(self, schema: Dict[str, Any]):
+        self.schema = schema
+        self.schema_json = json.dumps(schema, ensure_ascii=False, sort_keys=True)  # cache/prefix key
+        self.props: Dict[str, Any] = _schema_properties(schema)
+        self.required: List[str] = _schema_required_keys(schema)
+        self.has_technical = "technical" in self.props
+        self.has_filetype = "filetype" in self.props
+        self.types: Dict[str, str] = {
+            key: _schema_type(ps if isinstance(ps, dict) else {}) for key, ps in self.props.items()
+        }
+        self.nullable = {key for key, ps in self.props.items() if _schema_nullable(ps if isinstance(ps, dict) else {})}
+        # value validators for properties with enum/format/pattern constraints
+        self.checks: Dict[str, Callable[[Any], bool]] = {}
+        for key, ps in self.props.items():
+            check = _value_check(ps if isinstance(ps, dict) else {})
+            if check is not None:
+                self.checks[key] = check
+        # (key, normalizer, merger)
+        self.fields: List[Tuple[str, Callable[[Any], Any], Callable[[List[Any]], Any]]] = [
+            (key, *self._plan(key, ps if isinstance(ps, dict) else {})) for key, ps in self.props.items()
+        ]
+
+    @staticmethod
+    def _plan(key: str, prop_schema: Dict[str, Any]) -> Tuple[Callable[[Any], Any], Callable[[List[Any]], Any]]:
+        t = _schema_type(prop_schema)
+        normalize = _NORMALIZERS.get(t, _norm_string)
+        if t == "string":
+            mode = "concat" if key in CONCAT_KEYS else "first"
+            return normalize, lambda values: _merge_strings(values, mode=mode)
+        if t == "array":
+            items_schema = _schema_items_schema(prop_schema)
+            if _schema_type(items_schema) == "object":
+                keys = _derive_identity_keys(items_schema)
+                return normalize, lambda values: _merge_array_of_objects(values, items_schema, keys)
+            return normalize, _merge_array_of_scalars
+        if t == "object":
+            return normalize, _merge_objects
+        if t == "integer":
+            return normalize, _merge_integer
+        if t == "number":
+            return normalize, lambda values: _merge_numbers(values, mode="first")
+        if t == "boolean":
+            return normalize, _merge_boolean
+        return normalize, _first_non_empty
+
+    def normalize(self, obj: Dict[str, Any]) -> Dict[str, Any]:
+        """Coerce one model answer to the schema's property types (missing -> None)."""
+        out: Dict[str, Any] = {}
+        for key, normalize, _ in self.fields:
+            val = obj.get(key)
+            out[key] = None if val is None else normalize(val)
+        return out
+
+    def merge(self, chunk_dicts: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Merge normalized chunk answers into one record (schema properties only)."""
+        return {key: merge([d.get(key) for d in chunk_dicts]) for key, _, merge in self.fields}
+
+    def subschema(self, keys: List[str]) -> Dict[str, Any]:
+        """The schema restricted to `keys` (for re-querying a few fields)."""
+        return {
+            "type": "object",
+            "properties": {k: self.props[k] for k in keys if k in self.props},
+            "required": [k for k in self.required if k in keys],
+        }
+
+
+def compile_schema(schema: Any) -> CompiledSchema:
+    """Return `schema` compiled (no-op if it already is a CompiledSchema)."""
+    return schema if isinstance(schema, CompiledSchema) else CompiledSchema(schema)
 
 # -----------------------
 # Main aggregator
@@ -250,67 +504,18 @@ def _merge_arrays(values: List[Any], items_schema: Dict[str, Any]) -> List[Any]:
 
 def aggregate_chunk_dicts(
     chunk_dicts: List[Dict[str, Any]],
-    schema: Dict[str, Any],
+    schema: Any,
     *,
     technical: Optional[Dict[str, Any]] = None,
     filetype_guess: Optional[str] = None,
 ) -> Dict[str, Any]:
-    if not chunk_dicts:
-        base: Dict[str, Any] = {}
-        props: Dict[str, Any] = _schema_properties(schema)
-        if "technical" in props and technical is not None:
-            base["technical"] = technical
-        if "filetype" in props and filetype_guess is not None:
-            base["filetype"] = filetype_guess
-        return base
-
-    props: Dict[str, Any] = _schema_properties(schema)
-    out: Dict[str, Any] = {}
-
-    for key, prop_schema in props.items():
-        prop_schema = prop_schema if isinstance(prop_schema, dict) else {}
-        values = [d.get(key) for d in chunk_dicts]
-        t = _schema_type(prop_schema)
-
-        if t == "string":
-            merge_mode = "concat" if key in ("description", "samenvatting", "abstract", "notes") else "first"
-            out[key] = _merge_strings(values, mode=merge_mode)
-
-        elif t == "array":
-            items_schema = _schema_items_schema(prop_schema)
-            out[key] = _merge_arrays(values, items_schema)
-
-        elif t == "object":
-            out[key] = _merge_objects(values)
-
-        elif t in ("integer", "number"):
-            out[key] = _merge_numbers(values, mode="first")
-            if t == "integer" and isinstance(out[key], float):
-                try:
-                    out[key] = int(out[key])
-                except Exception:
-                    out[key] = None
-
-        elif t == "boolean":
-            out[key] = _first_non_empty(values)
-            if isinstance(out[key], str):
-                s = out[key].strip().lower()
-                if s in ("true", "ja", "yes", "1"):
-                    out[key] = True
-                elif s in ("false", "nee", "no", "0"):
-                    out[key] = False
-                else:
-                    out[key] = None
-
-        else:
-            out[key] = _first_non_empty(values)
+    """`schema` may be a JSON schema dict or a CompiledSchema (preferred for repeated calls)."""
+    cs = compile_schema(schema)
+    out: Dict[str, Any] = cs.merge(chunk_dicts) if chunk_dicts else {}
 
     # Ensure technical + filetype if schema expects them
-    if "technical" in props and (not isinstance(out.get("technical"), dict)) and technical is not None:
+    if cs.has_technical and (not isinstance(out.get("technical"), dict)) and technical is not None:
         out["technical"] = technical
-    if "filetype" in props and (not out.get("filetype")) and filetype_guess is not None:
+    if cs.has_filetype and (not out.get("filetype")) and filetype_guess is not None:
         out["filetype"] = filetype_guess
-
-    # Drop extras not in schema (optional)
-    out = {k: v for k, v in out.items() if k in props}
     return out
@@ -0,0 +1,248 @@
+from __future__ import annotations
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+
+# Pool of Ollama servers: health checks via /api/tags, per-backend model
+# availability and latency, least-loaded routing, temporary ejection
+# (circuit breaker) and an AIMD concurrency limit per backend.
+
+EWMA_ALPHA = 0.3
+
+# release() outcomes
+SUCCESS = "success"
+CLIENT_ERROR = "client_error"    # request was bad (4xx); says nothing about the backend
+ERROR = "error"                  # timeout, connection error, 5xx
+
+
+class BackendUnavailable(RuntimeError):
+    """All backends are ejected (circuit open) or at their concurrency limit for too long."""
+
+
+class Backend:
+    def __init__(self, url: str, initial_limit: float):
+        self.url = url.rstrip("/")
+        self.models: Set[str] = set()
+        self.healthy = True          # optimistic until the first check says otherwise
+        self.in_flight = 0
+        self.limit = float(initial_limit)        # AIMD concurrency limit
+        self.latency_s: Optional[float] = None   # EWMA of request latency (routing)
+        self.model_latency: Dict[str, float] = {}  # EWMA per model (slow-request detection)
+        self.model_samples: Dict[str, int] = {}
+        self.failures = 0            # consecutive failures
+        self.ejected_until = 0.0
+        self.tripped = False         # circuit opened by request failures; closed by a success
+        self.probing = False         # half-open: the single probe request is in flight
+
+    def available(self, now: float) -> bool:
+        return self.healthy and not self.tripped
+
+    def has_capacity(self) -> bool:
+        return self.in_flight < max(1, int(self.limit))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "ejected": self.tripped,
+            "in_flight": self.in_flight,
+            "limit": round(self.limit, 2),
+            "latency_s": self.latency_s,
+            "failures": self.failures,
+            "models": sorted(self.models),
+        }
+
+
+class BackendPool:
+    """
+    Routes each request to the least-loaded healthy backend that has the model.
+
+    Circuit breaker: a backend that fails `eject_after` times in a row is
+    ejected for `eject_s` seconds (doubling per repeat, capped at `max_eject_s`).
+    When every backend is ejected, acquire() fails fast with BackendUnavailable
+    until an ejection expires; then a single probe request is let through while
+    other requests wait for its outcome.
+    A failed /api/tags check only lowers a backend's routing preference; it
+    doesn't open the circuit.
+
+    AIMD: each backend has a concurrency limit between 1 and `max_concurrency`.
+    A fast success adds 1/limit; an error, or a success slower than
+    `slow_factor` x the latency EWMA, halves it. acquire() waits for a free slot.
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        fetch_tags: Callable[[str, float], Dict[str, Any]],
+        *,
+        health_interval_s: float = 30.0,
+        eject_after: int = 3,
+        eject_s: float = 15.0,
+        max_eject_s: float = 300.0,
+        max_concurrency: int = 8,
+        initial_concurrency: Optional[int] = None,
+        slow_factor: float = 3.0,
+        acquire_timeout_s: float = 600.0,
+    ):
+        if not urls:
+            raise ValueError("BackendPool needs at least one backend URL")
+        self.max_concurrency = max(1, int(max_concurrency))
+        initial = initial_concurrency or max(1, self.max_concurrency // 2)
+        self.backends = [Backend(u, min(initial, self.max_concurrency)) for u in urls]
+        self._fetch_tags = fetch_tags
+        self.health_interval_s = float(health_interval_s)
+        self.eject_after = int(eject_after)
+        self.eject_s = float(eject_s)
+        self.max_eject_s = float(max_eject_s)
+        self.slow_factor = float(slow_factor)
+        self.acquire_timeout_s = float(acquire_timeout_s)
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        self._last_check = 0.0
+        self._checking = False
+
+    # -----------------------
+    # Health
+    # -----------------------
+
+    def health_check(self, timeout_s: float = 4.0) -> None:
+        """Refresh model lists and health of every backend (GET /api/tags)."""
+        for b in self.backends:
+            try:
+                tags = self._fetch_tags(b.url, timeout_s)
+                models = {m.get("name") for m in tags.get("models", []) if m.get("name")}
+                with self._lock:
+                    b.models = models
+                    b.healthy = True
+                    b.failures = 0
+                    b.ejected_until = 0.0
+                    b.tripped = False
+                    self._slot_freed.notify_all()
+            except Exception:
+                with self._lock:
+                    b.healthy = False
+        with self._lock:
+            self._last_check = time.monotonic()
+
+    def _maybe_health_check(self) -> None:
+        with self._lock:
+            due = not self._checking and time.monotonic() - self._last_check >= self.health_interval_s
+            if due:
+                self._checking = True
+        if not due:
+            return
+        try:
+            self.health_check()
+        finally:
+            with self._lock:
+                self._checking = False
+
+    # -----------------------
+    # Routing
+    # -----------------------
+
+    def _candidates(self, model: Optional[str], now: float) -> List[Backend]:
+        up = [b for b in self.backends if b.available(now)]
+        if not up:
+            # a failed tags check alone doesn't stop traffic; requests will tell
+            up = [b for b in self.backends if not b.tripped]
+        if model:
+            # only filter when model lists are known; an empty list means "not checked yet"
+            with_model = [b for b in up if not b.models or model in b.models]
+            up = with_model or up
+        return up
+
+    def acquire(self, model: Optional[str] = None) -> Backend:
+        self._maybe_health_check()
+        deadline = time.monotonic() + self.acquire_timeout_s
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                up = self._candidates(model, now)
+                if not up:
+                    # circuit open everywhere: probe a backend whose ejection has ended,
+                    # wait while a probe is out, otherwise fail fast
+                    ready = [b for b in self.backends if not b.probing and now >= b.ejected_until]
+                    if ready:
+                        # half-open: only this request goes through until it reports back
+                        probe = ready[0]
+                        probe.probing = True
+                        probe.in_flight += 1
+                        return probe
+                    if not any(b.probing for b in self.backends):
+                        retry_s = min(b.ejected_until for b in self.backends) - now
+                        raise BackendUnavailable(f"all Ollama backends unavailable; retry in {retry_s:.0f}s")
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise BackendUnavailable("all Ollama backends unavailable (probe pending)")
+                    self._slot_freed.wait(timeout=min(remaining, 1.0))
+                    continue
+
+                free = [b for b in up if b.has_capacity()]
+                if free:
+                    b = min(free, key=lambda b: (b.in_flight / max(1.0, b.limit), b.latency_s or 0.0))
+                    b.in_flight += 1
+                    return b
+
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise BackendUnavailable("all Ollama backends at their concurrency limit")
+                self._slot_freed.wait(timeout=min(remaining, 1.0))
+
+    def release(self, b: Backend, elapsed_s: float, outcome: str, model: Optional[str] = None) -> None:
+        with self._lock:
+            b.in_flight = max(0, b.in_flight - 1)
+            b.probing = False
+            if outcome != ERROR:
+                # the backend answered (a 4xx too): close the circuit
+                b.tripped = False
+            if outcome == SUCCESS:
+                key = model or ""
+                base = b.model_latency.get(key)
+                slow = base is not None and b.model_samples.get(key, 0) >= 3 and elapsed_s > self.slow_factor * base
+                if slow:
+                    b.limit = max(1.0, b.limit / 2)
+                else:
+                    b.limit = min(float(self.max_concurrency), b.limit + 1.0 / b.limit)
+                b.failures = 0
+                b.healthy = True
+                b.ejected_until = 0.0
+                self._observe(b, elapsed_s)
+                b.model_latency[key] = elapsed_s if base is None else (1 - EWMA_ALPHA) * base + EWMA_ALPHA * elapsed_s
+                b.model_samples[key] = b.model_samples.get(key, 0) + 1
+            elif outcome == ERROR:
+                b.limit = max(1.0, b.limit / 2)
+                b.failures += 1
+                if b.failures >= self.eject_after:
+                    repeats = b.failures - self.eject_after
+                    b.tripped = True
+                    b.ejected_until = time.monotonic() + min(self.eject_s * (2 ** repeats), self.max_eject_s)
+                    print(f"[ollama] ejecting backend {b.url} after {b.failures} failures")
+            self._slot_freed.notify_all()
+
+    def _observe(self, b: Backend, elapsed_s: float) -> None:
+        b.latency_s = elapsed_s if b.latency_s is None else (1 - EWMA_ALPHA) * b.latency_s + EWMA_ALPHA * elapsed_s
+
+    @contextmanager
+    def route(self, model: Optional[str] = None) -> Iterator[Backend]:
+        """
+        with pool.route(model) as b: ...request b.url...
+        An exception inside the block counts as a backend error, unless it is
+        marked with `backend_ok = True` (e.g. a 4xx for a bad request).
+        """
+        b = self.acquire(model)
+        t0 = time.monotonic()
+        outcome = ERROR
+        try:
+            yield b
+            outcome = SUCCESS
+        except Exception as e:
+            outcome = CLIENT_ERROR if getattr(e, "backend_ok", False) else ERROR
+            raise
+        finally:
+            self.release(b, time.monotonic() - t0, outcome, model)
+
+    def status(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [b.snapshot() for b in self.backends]
@@ -1,26 +1,103 @@
 from __future__ import annotations
 import json, hashlib
-from pathlib import Path
+import sqlite3
+import threading
+import time
 from typing import Optional, Dict, Any
-from .config import CACHE_DIR
+from .config import LLM_CACHE_PATH, LLM_CACHE_MAX_BYTES
 
-def _ckey(model: str, file_sha: str, chunk_idx: int) -> Path:
-    CACHE_DIR.mkdir(parents=True, exist_ok=True)
-    key = hashlib.sha256(f"{model}|{file_sha}|{chunk_idx}".encode()).hexdigest()
-    return CACHE_DIR / f"chunk_{key}.json"
+# Content-addressed cache for LLM results: one SQLite file, LRU-evicted by size.
 
-def cache_load(model: str, file_sha: str, chunk_idx: int) -> Optional[Dict[str, Any]]:
-    p = _ckey(model, file_sha, chunk_idx)
-    if p.exists():
+_EVICT_EVERY = 50
+_puts = 0
+_lock = threading.Lock()
+
+def _get_conn() -> sqlite3.Connection:
+    LLM_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(LLM_CACHE_PATH), timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("""CREATE TABLE IF NOT EXISTS llm_cache (
+        key TEXT PRIMARY KEY,
+        value_json TEXT NOT NULL,
+        size_bytes INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        last_used_at REAL NOT NULL
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_lru ON llm_cache(last_used_at)")
+    return conn
+
+def cache_key(model: str, schema: Any, prompt_version: str, text: str, extra: Optional[Dict[str, Any]] = None) -> str:
+    """
+    hash(model, schema, prompt version, text[, extra generation options]).
+    `schema` may be passed pre-serialized (canonical JSON string) to skip the dump.
+    """
+    h = hashlib.sha256()
+    for part in (
+        model,
+        schema if isinstance(schema, str) else json.dumps(schema, ensure_ascii=False, sort_keys=True),
+        prompt_version,
+        json.dumps(extra or {}, ensure_ascii=False, sort_keys=True),
+        text,
+    ):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def cache_get(key: str) -> Optional[Dict[str, Any]]:
+    try:
+        conn = _get_conn()
         try:
-            return json.loads(p.read_text(encoding="utf-8"))
-        except Exception:
-            return None
-    return None
+            row = conn.execute("SELECT value_json FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if not row:
+                return None
+            conn.execute("UPDATE llm_cache SET last_used_at = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            return json.loads(row[0])
+        finally:
+            conn.close()
+    except Exception:
+        return None
 
-def cache_save(model: str, file_sha: str, chunk_idx: int, data: Dict[str, Any]) -> None:
-    p = _ckey(model, file_sha, chunk_idx)
+def cache_put(key: str, data: Dict[str, Any]) -> None:
+    global _puts
     try:
-        p.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        value = json.dumps(data, ensure_ascii=False)
+        now = time.time()
+        conn = _get_conn()
+        try:
+            conn.execute(
+                """INSERT INTO llm_cache (key, value_json, size_bytes, created_at, last_used_at)
+                   VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT(key) DO UPDATE SET
+                       value_json=excluded.value_json,
+                       size_bytes=excluded.size_bytes,
+                       last_used_at=excluded.last_used_at""",
+                (key, value, len(value.encode("utf-8")), now, now),
+            )
+            conn.commit()
+            with _lock:
+                _puts += 1
+                check = _puts % _EVICT_EVERY == 1
+            if check:
+                _evict(conn, LLM_CACHE_MAX_BYTES)
+        finally:
+            conn.close()
     except Exception:
         pass
+
+def _evict(conn: sqlite3.Connection, max_bytes: int) -> None:
+    """Drop least-recently-used entries until the cache is below 90% of max_bytes."""
+    total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM llm_cache").fetchone()[0]
+    if total <= max_bytes:
+        return
+    target = int(max_bytes * 0.9)
+    freed = 0
+    keys = []
+    for key, size in conn.execute("SELECT key, size_bytes FROM llm_cache ORDER BY last_used_at ASC"):
+        keys.append((key,))
+        freed += size
+        if total - freed <= target:
+            break
+    conn.executemany("DELETE FROM llm_cache WHERE key = ?", keys)
+    conn.commit()
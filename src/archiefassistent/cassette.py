@@ -0,0 +1,96 @@
+from __future__ import annotations
+import hashlib
+import json
+import sqlite3
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Record/replay of Ollama traffic. In "record" mode every generate/embed
+# response is stored (zlib-compressed JSON) under a hash of its request
+# payload; in "replay" mode the same requests are answered from the file
+# without contacting Ollama, optionally with the recorded latency.
+
+RECORD = "record"
+REPLAY = "replay"
+
+# Payload fields that don't change the answer
+_VOLATILE_KEYS = ("stream", "keep_alive")
+
+
+class CassetteMiss(LookupError):
+    """Replay mode got a request that was never recorded."""
+
+
+class Cassette:
+    def __init__(self, path: Any, mode: str = REPLAY, *, replay_latency: bool = False):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"unknown cassette mode: {mode!r}")
+        self.path = Path(path)
+        self.mode = mode
+        self.replay_latency = bool(replay_latency)
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+
+    def _get_conn(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.path), timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("""CREATE TABLE IF NOT EXISTS calls (
+            key TEXT PRIMARY KEY,
+            endpoint TEXT NOT NULL,
+            response BLOB NOT NULL,
+            latency_s REAL NOT NULL,
+            created_at REAL NOT NULL
+        )""")
+        return conn
+
+    @staticmethod
+    def key(endpoint: str, payload: Dict[str, Any]) -> str:
+        stable = {k: v for k, v in payload.items() if k not in _VOLATILE_KEYS}
+        body = json.dumps(stable, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(f"{endpoint}\0{body}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        conn = self._get_conn()
+        try:
+            row = conn.execute("SELECT response, latency_s FROM calls WHERE key = ?", (key,)).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return None
+        return json.loads(zlib.decompress(row[0]).decode("utf-8")), float(row[1])
+
+    def put(self, key: str, endpoint: str, response: Any, latency_s: float) -> None:
+        blob = zlib.compress(json.dumps(response, ensure_ascii=False).encode("utf-8"))
+        conn = self._get_conn()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO calls (key, endpoint, response, latency_s, created_at) VALUES (?, ?, ?, ?, ?)",
+                (key, endpoint, blob, float(latency_s), time.time()),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        self.recorded += 1
+
+    def call(self, endpoint: str, payload: Dict[str, Any], send: Callable[[], Any]) -> Any:
+        """Replay the response for `payload`, or run `send()` and record its result."""
+        key = self.key(endpoint, payload)
+        if self.mode == REPLAY:
+            hit = self.get(key)
+            if hit is None:
+                self.misses += 1
+                raise CassetteMiss(f"no recorded {endpoint} response for this request ({key[:12]})")
+            self.hits += 1
+            response, latency_s = hit
+            if self.replay_latency:
+                time.sleep(latency_s)
+            return response
+
+        t0 = time.monotonic()
+        response = send()
+        self.put(key, endpoint, response, time.monotonic() - t0)
+        return response
@@ -1,14 +1,34 @@
+import os
 from pathlib import Path
 
 APP_TITLE = "De Archiefassistent"
 DEFAULT_MODEL = "llama3.2:3b"
 OLLAMA_BASE = "http://localhost:11434"
+# One or more Ollama servers; requests go to the least-loaded healthy one.
+# Override with a comma-separated list in ARCHIEF_OLLAMA_BACKENDS.
+OLLAMA_BACKENDS = [u.strip() for u in os.environ.get("ARCHIEF_OLLAMA_BACKENDS", OLLAMA_BASE).split(",") if u.strip()]
+OLLAMA_CONNECT_TIMEOUT_S = 5
+OLLAMA_HTTP_POOL_SIZE = 8
+OLLAMA_MAX_CONCURRENCY = 8   # per backend; the adaptive limit stays at or below this
+OLLAMA_KEEP_ALIVE = "30m"
+# Context / output sizes are rounded up to one of these, so requests share a few
+# num_ctx values (Ollama reloads the model whenever num_ctx changes).
+OLLAMA_CTX_BUCKETS = (2048, 4096, 8192, 16384)
+OLLAMA_PREDICT_BUCKETS = (256, 512, 1024, 2048)
+# Record/replay Ollama traffic (see cassette.py): path of the cassette file,
+# "record" or "replay", and whether replay sleeps for the recorded latency.
+OLLAMA_CASSETTE = os.environ.get("ARCHIEF_OLLAMA_CASSETTE") or None
+OLLAMA_CASSETTE_MODE = os.environ.get("ARCHIEF_OLLAMA_CASSETTE_MODE", "replay")
+OLLAMA_CASSETTE_LATENCY = os.environ.get("ARCHIEF_OLLAMA_CASSETTE_LATENCY", "") in ("1", "true", "yes")
 
 SUPPORTED_EXTS = {".txt", ".md", ".pdf", ".docx", ".html", ".htm", ".zip"}
 
 CACHE_DIR = Path.home() / ".archiefassistent_cache"
 DB_PATH = CACHE_DIR / "jobs.db"
 UPLOADS_DIR = CACHE_DIR / "uploads"
+WAKE_DIR = CACHE_DIR / "wake"
+LLM_CACHE_PATH = CACHE_DIR / "llm_cache.db"
+LLM_CACHE_MAX_BYTES = 512 * 1024 * 1024
 
 PROJECT_ROOT = Path(__file__).resolve().parents[2]  # archiefassistent/
 ASSETS_DIR = PROJECT_ROOT / "assets"
@@ -1,11 +1,12 @@
 from __future__ import annotations
 import json
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 
 from .config import DB_PATH, CACHE_DIR
+from .notify import notify_workers
 
 DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 
@@ -86,6 +87,29 @@ def init_db() -> None:
         FOREIGN KEY(profile_id) REFERENCES export_profiles(id)
     )""")
 
+    # Per-call token/timing accounting (one row per Ollama call or cache hit)
+    cur.execute("""CREATE TABLE IF NOT EXISTS llm_calls (
+        id INTEGER PRIMARY KEY,
+        job_id INTEGER,
+        filename TEXT,
+        chunk_index INTEGER,
+        kind TEXT,                    -- 'generate', 'repair', 'warmup', 'embed'
+        model TEXT,
+        backend TEXT,
+        cached INTEGER DEFAULT 0,
+        prompt_eval_count INTEGER,
+        eval_count INTEGER,
+        total_ms REAL,                -- server side: total_duration
+        load_ms REAL,                 -- server side: model load (non-zero = load event)
+        prompt_eval_ms REAL,
+        eval_ms REAL,
+        wait_ms REAL,                 -- client side: waiting for a backend slot
+        wall_ms REAL,                 -- client side: request round-trip
+        created_at TEXT,
+        FOREIGN KEY(job_id) REFERENCES jobs(id)
+    )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_llm_calls_job ON llm_calls(job_id, filename)")
+
     cur.execute("PRAGMA table_info(jobs)")
     existing = [row[1] for row in cur.fetchall()]
     if "total_files" not in existing:
@@ -96,6 +120,38 @@ def init_db() -> None:
     if "options_json" not in existing:
         cur.execute("ALTER TABLE jobs ADD COLUMN options_json TEXT DEFAULT '{}'")
 
+    # Job leasing (multiple workers draining the same queue)
+    if "lease_owner" not in existing:
+        cur.execute("ALTER TABLE jobs ADD COLUMN lease_owner TEXT")
+    if "lease_expires_at" not in existing:
+        cur.execute("ALTER TABLE jobs ADD COLUMN lease_expires_at TEXT")
+    if "heartbeat_at" not in existing:
+        cur.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at TEXT")
+
+    # Job kinds: 'extract' (files -> records) or 'schema' (description -> JSON Schema,
+    # result kept in result_json for the page that queued it)
+    if "kind" not in existing:
+        cur.execute("ALTER TABLE jobs ADD COLUMN kind TEXT DEFAULT 'extract'")
+    if "result_json" not in existing:
+        cur.execute("ALTER TABLE jobs ADD COLUMN result_json TEXT")
+
+    # Per-file checkpoints: a record keyed by (path, sha256) marks the file as done
+    cur.execute("PRAGMA table_info(records)")
+    rec_cols = [row[1] for row in cur.fetchall()]
+    if "path" not in rec_cols:
+        cur.execute("ALTER TABLE records ADD COLUMN path TEXT")
+    if "sha256" not in rec_cols:
+        cur.execute("ALTER TABLE records ADD COLUMN sha256 TEXT")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_records_job_path ON records(job_id, path)")
+
+    # Content hash of preprocessed files as a column, so lookups by hash use an index
+    cur.execute("PRAGMA table_info(preprocess_files)")
+    pre_cols = [row[1] for row in cur.fetchall()]
+    if "sha256" not in pre_cols:
+        cur.execute("ALTER TABLE preprocess_files ADD COLUMN sha256 TEXT")
+        cur.execute("UPDATE preprocess_files SET sha256 = json_extract(technical_json, '$.sha256')")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_preprocess_files_sha256 ON preprocess_files(sha256)")
+
     conn.commit()
     conn.close()
 
@@ -104,8 +160,8 @@ def save_preprocess_file(job_id: int, filename: str, path: str, technical: Dict[
     cur = conn.cursor()
     now = datetime.utcnow().isoformat()
     cur.execute(
-        "INSERT INTO preprocess_files (job_id, filename, path, technical_json, created_at) VALUES (?, ?, ?, ?, ?)",
-        (int(job_id), filename, path, json.dumps(technical, ensure_ascii=False), now),
+        "INSERT INTO preprocess_files (job_id, filename, path, technical_json, created_at, sha256) VALUES (?, ?, ?, ?, ?, ?)",
+        (int(job_id), filename, path, json.dumps(technical, ensure_ascii=False), now, technical.get("sha256")),
     )
     file_id = cur.lastrowid
     conn.commit()
@@ -148,18 +204,73 @@ def save_preprocess_chunk(
     conn.commit()
     conn.close()
 
-def create_job(name: str, root_dir: str, model_tag: str, options: Optional[Dict[str, Any]] = None) -> int:
+def find_preprocessed_file(sha256: str) -> Optional[Dict[str, Any]]:
+    """Latest preprocess_files row for a file with this content hash (any preprocess job)."""
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        """SELECT * FROM preprocess_files
+            WHERE sha256 = ?
+            ORDER BY id DESC LIMIT 1""",
+        (sha256,),
+    )
+    row = cur.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def list_preprocess_job_ids() -> List[int]:
+    """Jobs that have preprocessed files (and so embed chunks retrieval may use)."""
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT DISTINCT job_id FROM preprocess_files WHERE job_id IS NOT NULL")
+    ids = [int(r[0]) for r in cur.fetchall()]
+    conn.close()
+    return ids
+
+def get_preprocess_chunks(preprocess_file_id: int, chunk_type: str = "embed") -> List[Dict[str, Any]]:
+    """Chunks of one preprocessed file (with embeddings only), in chunk order."""
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        """SELECT chunk_index, start_char, end_char, chunk_text, embedding_json
+             FROM preprocess_chunks
+            WHERE preprocess_file_id = ? AND chunk_type = ? AND embedding_json IS NOT NULL
+            ORDER BY chunk_index""",
+        (int(preprocess_file_id), chunk_type),
+    )
+    rows: List[Dict[str, Any]] = []
+    for r in cur.fetchall():
+        d = dict(r)
+        try:
+            d["embedding"] = json.loads(d.pop("embedding_json") or "null")
+        except Exception:
+            d["embedding"] = None
+        if isinstance(d["embedding"], list) and d["embedding"]:
+            rows.append(d)
+    conn.close()
+    return rows
+
+def create_job(
+    name: str,
+    root_dir: str,
+    model_tag: str,
+    options: Optional[Dict[str, Any]] = None,
+    status: str = "queued",
+    kind: str = "extract",
+) -> int:
     conn = _get_conn()
     cur = conn.cursor()
     now = datetime.utcnow().isoformat()
     options_json = json.dumps(options or {}, ensure_ascii=False)
     cur.execute(
-        "INSERT INTO jobs (name, root_dir, model_tag, options_json, created_at, status) VALUES (?, ?, ?, ?, ?, ?)",
-        (name, root_dir, model_tag, options_json, now, "queued")
+        "INSERT INTO jobs (name, root_dir, model_tag, options_json, created_at, status, kind) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (name, root_dir, model_tag, options_json, now, status, kind)
     )
     job_id = cur.lastrowid
     conn.commit()
     conn.close()
+    if status == "queued":
+        notify_workers()
     return int(job_id)
 
 def update_job_status(job_id: int, status: str) -> None:
@@ -183,21 +294,59 @@ def increment_job_files_done(job_id: int) -> None:
     conn.commit()
     conn.close()
 
-def save_record(job_id: int, filename: str, record: Dict[str, Any]) -> None:
+def set_job_files_done(job_id: int, done: int) -> None:
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("UPDATE jobs SET files_done = ? WHERE id = ?", (int(done), job_id))
+    conn.commit()
+    conn.close()
+
+def save_record(
+    job_id: int,
+    filename: str,
+    record: Dict[str, Any],
+    *,
+    path: Optional[str] = None,
+    sha256: Optional[str] = None,
+) -> None:
+    """
+    Insert a record. When path + sha256 are given the record doubles as the
+    file's checkpoint and is not inserted twice for the same job.
+    """
     conn = _get_conn()
     cur = conn.cursor()
     now = datetime.utcnow().isoformat()
+    if path and sha256:
+        cur.execute(
+            """INSERT INTO records (job_id, filename, record_json, created_at, path, sha256)
+               SELECT ?, ?, ?, ?, ?, ?
+                WHERE NOT EXISTS (SELECT 1 FROM records WHERE job_id = ? AND path = ? AND sha256 = ?)""",
+            (job_id, filename, json.dumps(record, ensure_ascii=False), now, path, sha256, job_id, path, sha256)
+        )
+    else:
+        cur.execute(
+            "INSERT INTO records (job_id, filename, record_json, created_at) VALUES (?, ?, ?, ?)",
+            (job_id, filename, json.dumps(record, ensure_ascii=False), now)
+        )
+    conn.commit()
+    conn.close()
+
+def get_completed_files(job_id: int) -> Dict[str, str]:
+    """Checkpointed files of a job as {path: sha256}."""
+    conn = _get_conn()
+    cur = conn.cursor()
     cur.execute(
-        "INSERT INTO records (job_id, filename, record_json, created_at) VALUES (?, ?, ?, ?)",
-        (job_id, filename, json.dumps(record, ensure_ascii=False), now)
+        "SELECT path, sha256 FROM records WHERE job_id = ? AND path IS NOT NULL AND sha256 IS NOT NULL",
+        (int(job_id),),
     )
-    conn.commit()
+    out = {r["path"]: r["sha256"] for r in cur.fetchall()}
     conn.close()
+    return out
 
-def list_jobs() -> List[Dict[str, Any]]:
+def list_jobs(kind: str = "extract") -> List[Dict[str, Any]]:
     conn = _get_conn()
     cur = conn.cursor()
-    cur.execute("SELECT * FROM jobs ORDER BY created_at DESC")
+    cur.execute("SELECT * FROM jobs WHERE COALESCE(kind, 'extract') = ? ORDER BY created_at DESC", (kind,))
     rows = []
     for r in cur.fetchall():
         d = dict(r)
@@ -222,8 +371,19 @@ def get_job(job_id: int) -> Optional[Dict[str, Any]]:
         d["options"] = json.loads(d.get("options_json") or "{}")
     except Exception:
         d["options"] = {}
+    try:
+        d["result"] = json.loads(d["result_json"]) if d.get("result_json") else None
+    except Exception:
+        d["result"] = None
     return d
 
+def set_job_result(job_id: int, result: Any) -> None:
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("UPDATE jobs SET result_json = ? WHERE id = ?", (json.dumps(result, ensure_ascii=False), int(job_id)))
+    conn.commit()
+    conn.close()
+
 def get_job_records(job_id: int) -> List[Dict[str, Any]]:
     conn = _get_conn()
     cur = conn.cursor()
@@ -253,12 +413,136 @@ def update_record_db(record_id: int, new_record: Dict[str, Any]) -> None:
     finally:
         conn.close()
 
-def get_next_queued_job() -> Optional[Dict[str, Any]]:
+def record_llm_call(job_id: int, filename: Optional[str], chunk_index: Optional[int], usage: Dict[str, Any]) -> None:
     conn = _get_conn()
     cur = conn.cursor()
-    cur.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at ASC LIMIT 1")
+    now = datetime.utcnow().isoformat()
+    cur.execute(
+        """INSERT INTO llm_calls
+           (job_id, filename, chunk_index, kind, model, backend, cached,
+            prompt_eval_count, eval_count, total_ms, load_ms, prompt_eval_ms, eval_ms,
+            wait_ms, wall_ms, created_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        (
+            int(job_id),
+            filename,
+            chunk_index,
+            usage.get("kind"),
+            usage.get("model"),
+            usage.get("backend"),
+            1 if usage.get("cached") else 0,
+            usage.get("prompt_eval_count"),
+            usage.get("eval_count"),
+            usage.get("total_ms"),
+            usage.get("load_ms"),
+            usage.get("prompt_eval_ms"),
+            usage.get("eval_ms"),
+            usage.get("wait_ms"),
+            usage.get("wall_ms"),
+            now,
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+# Model loads below this are just "already resident" overhead
+LOAD_EVENT_MS = 500
+
+_LLM_ROLLUP = f"""
+    COUNT(*) AS calls,
+    SUM(cached) AS cached_calls,
+    SUM(CASE WHEN kind = 'repair' THEN 1 ELSE 0 END) AS repair_calls,
+    COALESCE(SUM(prompt_eval_count), 0) AS prompt_tokens,
+    COALESCE(SUM(eval_count), 0) AS output_tokens,
+    COALESCE(SUM(prompt_eval_ms), 0) / 1000.0 AS prompt_eval_s,
+    COALESCE(SUM(eval_ms), 0) / 1000.0 AS eval_s,
+    COALESCE(SUM(total_ms), 0) / 1000.0 AS compute_s,
+    COALESCE(SUM(wall_ms), 0) / 1000.0 AS wall_s,
+    -- round-trip not spent computing, only over calls that report server timings
+    (COALESCE(SUM(wait_ms), 0)
+        + MAX(COALESCE(SUM(CASE WHEN total_ms IS NOT NULL THEN wall_ms END), 0) - COALESCE(SUM(total_ms), 0), 0)) / 1000.0 AS waiting_s,
+    SUM(CASE WHEN load_ms >= {LOAD_EVENT_MS} THEN 1 ELSE 0 END) AS load_events,
+    COALESCE(SUM(CASE WHEN load_ms >= {LOAD_EVENT_MS} THEN load_ms ELSE 0 END), 0) / 1000.0 AS load_s,
+    CASE WHEN SUM(eval_ms) > 0 THEN SUM(eval_count) * 1000.0 / SUM(eval_ms) END AS output_tokens_per_s,
+    CASE WHEN SUM(prompt_eval_ms) > 0 THEN SUM(prompt_eval_count) * 1000.0 / SUM(prompt_eval_ms) END AS prompt_tokens_per_s
+"""
+
+def get_job_llm_stats(job_id: int) -> Dict[str, Any]:
+    """Token/timing totals for a job. waiting_s = slot wait + round-trip not spent computing."""
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(f"SELECT {_LLM_ROLLUP} FROM llm_calls WHERE job_id = ?", (int(job_id),))
     row = cur.fetchone()
     conn.close()
+    return dict(row) if row else {}
+
+def get_file_llm_stats(job_id: int) -> List[Dict[str, Any]]:
+    """Token/timing totals per file of a job, most expensive first."""
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        f"""SELECT filename, {_LLM_ROLLUP}
+              FROM llm_calls
+             WHERE job_id = ? AND filename IS NOT NULL
+             GROUP BY filename
+             ORDER BY compute_s DESC""",
+        (int(job_id),),
+    )
+    rows = [dict(r) for r in cur.fetchall()]
+    conn.close()
+    return rows
+
+def claim_next_job(
+    owner: str,
+    lease_seconds: int = 300,
+    *,
+    prefer_models: Optional[List[str]] = None,
+    max_wait_s: int = 600,
+    kinds: Optional[List[str]] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Atomically lease the next claimable job for `owner` and mark it running.
+    Claimable: status 'queued', or 'running' with an expired lease (crashed worker).
+    A single UPDATE ... RETURNING, so two workers can never claim the same job.
+
+    Schema jobs go first: they are small and someone is waiting on the page.
+    Then jobs whose model is in `prefer_models` (already loaded in Ollama),
+    so the server doesn't swap models between jobs; a job that has waited
+    longer than `max_wait_s` is taken first regardless (fairness). Otherwise
+    oldest first. `kinds` limits the claim to those job kinds (default: any).
+    """
+    conn = _get_conn()
+    cur = conn.cursor()
+    now = datetime.utcnow()
+    now_s = now.isoformat()
+    expires = (now + timedelta(seconds=int(lease_seconds))).isoformat()
+    overdue = (now - timedelta(seconds=int(max_wait_s))).isoformat()
+    kinds_json = json.dumps(list(kinds)) if kinds else None
+    cur.execute(
+        """
+        UPDATE jobs
+           SET status = 'running', lease_owner = ?, lease_expires_at = ?, heartbeat_at = ?
+         WHERE id = (
+            SELECT id FROM jobs
+             WHERE (status = 'queued'
+                    OR (status = 'running' AND lease_expires_at IS NOT NULL AND lease_expires_at < ?))
+               AND (? IS NULL OR COALESCE(kind, 'extract') IN (SELECT value FROM json_each(?)))
+             ORDER BY CASE
+                        WHEN kind = 'schema' THEN 0
+                        WHEN created_at < ? THEN 1
+                        WHEN model_tag IN (SELECT value FROM json_each(?)) THEN 2
+                        ELSE 3
+                      END,
+                      created_at ASC
+             LIMIT 1
+         )
+        RETURNING *
+        """,
+        (owner, expires, now_s, now_s, kinds_json, kinds_json, overdue, json.dumps(list(prefer_models or []))),
+    )
+    row = cur.fetchone()
+    conn.commit()
+    conn.close()
     if not row:
         return None
     d = dict(row)
@@ -268,10 +552,47 @@ def get_next_queued_job() -> Optional[Dict[str, Any]]:
         d["options"] = {}
     return d
 
+def cancel_queued_job(job_id: int) -> bool:
+    """Cancel a job nobody has claimed yet. Returns False if a worker already has it."""
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("UPDATE jobs SET status = 'cancelled' WHERE id = ? AND status = 'queued'", (int(job_id),))
+    ok = cur.rowcount > 0
+    conn.commit()
+    conn.close()
+    return ok
+
+def heartbeat_job(job_id: int, owner: str, lease_seconds: int = 300) -> bool:
+    """Extend the lease on a job. Returns False if `owner` no longer holds it."""
+    conn = _get_conn()
+    cur = conn.cursor()
+    now = datetime.utcnow()
+    expires = (now + timedelta(seconds=int(lease_seconds))).isoformat()
+    cur.execute(
+        "UPDATE jobs SET lease_expires_at = ?, heartbeat_at = ? WHERE id = ? AND lease_owner = ?",
+        (expires, now.isoformat(), int(job_id), owner),
+    )
+    ok = cur.rowcount > 0
+    conn.commit()
+    conn.close()
+    return ok
+
+def release_job(job_id: int, owner: str, status: str) -> None:
+    """Set the final status of a leased job and drop the lease."""
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        "UPDATE jobs SET status = ?, lease_owner = NULL, lease_expires_at = NULL WHERE id = ? AND lease_owner = ?",
+        (status, int(job_id), owner),
+    )
+    conn.commit()
+    conn.close()
+
 def delete_job(job_id: int) -> None:
     conn = _get_conn()
     cur = conn.cursor()
     cur.execute("DELETE FROM records WHERE job_id = ?", (job_id,))
+    cur.execute("DELETE FROM llm_calls WHERE job_id = ?", (job_id,))
     cur.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
     conn.commit()
     conn.close()
@@ -1,22 +1,372 @@
 # src/archiefassistent/jobs.py
 from __future__ import annotations
 
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from importlib.metadata import files
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Deque, Iterator, List, Tuple
 
 from .schemas import FileTechnical, ArchiveMetadata, model_to_dict
 from .extraction import walk_files, extract_text, sha256_file
 from .chunking import chunk_text
-from .ollama_client import call_ollama_structured, DEFAULT_SCHEMA
-from .aggregation import aggregate_chunk_dicts
+from .ollama_client import (
+    OllamaCallPool,
+    call_ollama_structured,
+    call_ollama_structured_async,
+    call_ollama_packed,
+    packed_doc_limit,
+    set_http_pool_size,
+    extraction_prefix,
+    generation_sizes,
+    max_chunk_chars,
+    warm_up_model,
+    DEFAULT_SCHEMA,
+)
+from .config import OLLAMA_KEEP_ALIVE
+from .aggregation import (
+    CompiledSchema,
+    aggregate_chunk_dicts,
+    compile_schema,
+    default_stop_fields,
+    escalation_fields,
+    missing_fields,
+)
+from .retrieval import PropertyRetriever
 from .db import (
     save_record,
     set_job_total_files,
+    set_job_files_done,
     increment_job_files_done,
+    get_completed_files,
+    record_llm_call,
 )
 
 
+def _prepare_file(path: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    CPU-bound part of processing one file: text extraction + hashing.
+    Module-level (picklable) so it can run inside a ProcessPoolExecutor.
+    """
+    fp = Path(path)
+    text = extract_text(fp)
+    tech = FileTechnical(
+        path=str(fp),
+        filename=fp.name,
+        extension=fp.suffix.lower(),
+        size_bytes=fp.stat().st_size,
+        sha256=sha256_file(fp),
+    )
+    return text, model_to_dict(tech)
+
+
+def _iter_prepared(
+    files: List[Path],
+    extract_workers: int,
+) -> Iterator[Tuple[Path, Optional[str], Optional[Dict[str, Any]], Optional[Exception]]]:
+    """
+    Yield (path, text, technical, error) in file order.
+    With extract_workers > 1 extraction runs in a process pool, a bounded number
+    of files ahead of the consumer, so the LLM stage never waits on pypdf.
+    """
+    if extract_workers <= 1:
+        for fp in files:
+            try:
+                text, tech = _prepare_file(str(fp))
+                yield fp, text, tech, None
+            except Exception as e:
+                yield fp, None, None, e
+        return
+
+    window = extract_workers * 4
+    with ProcessPoolExecutor(max_workers=extract_workers) as pool:
+        pending: Deque[Tuple[Path, Future]] = deque()
+        it = iter(files)
+        for fp in it:
+            pending.append((fp, pool.submit(_prepare_file, str(fp))))
+            if len(pending) >= window:
+                break
+        while pending:
+            fp, fut = pending.popleft()
+            nxt = next(it, None)
+            if nxt is not None:
+                pending.append((nxt, pool.submit(_prepare_file, str(nxt))))
+            try:
+                text, tech = fut.result()
+                yield fp, text, tech, None
+            except Exception as e:
+                yield fp, None, None, e
+
+
+def _is_completed(fp: Path, completed: Dict[str, str]) -> bool:
+    sha = completed.get(str(fp))
+    if sha is None:
+        return False
+    try:
+        return sha256_file(fp) == sha
+    except Exception:
+        return False
+
+
+def _usage_recorder(job_id: int, filename: Optional[str], chunk_index: Optional[int]):
+    """on_usage callback that stores per-call token/timing stats in llm_calls."""
+    def record(usage: Dict[str, Any]) -> None:
+        try:
+            record_llm_call(job_id, filename, chunk_index, usage)
+        except Exception as e:
+            print(f"Recording model usage failed: {e}")
+    return record
+
+
+def _extract_until_filled(
+    job_id: int,
+    fp: Path,
+    chunks: List[str],
+    stop_fields: List[str],
+    schema: CompiledSchema,
+    tech_dict: Dict[str, Any],
+    filetype_guess: str,
+    **call_kwargs: Any,
+) -> List[Dict[str, Any]]:
+    """
+    Call the model chunk by chunk until all stop_fields are filled in the running
+    aggregate. Returns one dict per chunk called ({} where the call failed);
+    raises the last error when no call succeeded.
+    """
+    chunk_dicts: List[Dict[str, Any]] = []
+    error: Optional[Exception] = None
+    for idx, ch in enumerate(chunks):
+        try:
+            chunk_dicts.append(
+                call_ollama_structured(
+                    content=ch, schema=schema, on_usage=_usage_recorder(job_id, fp.name, idx), **call_kwargs
+                )
+            )
+        except Exception as e:
+            print(f"Model failed on chunk {idx+1} of {fp.name}: {e}")
+            chunk_dicts.append({})
+            error = e
+            continue
+        merged = aggregate_chunk_dicts(chunk_dicts, schema=schema, technical=tech_dict, filetype_guess=filetype_guess)
+        if not missing_fields(merged, stop_fields):
+            if idx + 1 < len(chunks):
+                print(f"Early stop on {fp.name} after chunk {idx+1}/{len(chunks)}")
+            break
+    if error is not None and not any(chunk_dicts):
+        raise error
+    return chunk_dicts
+
+
+def _extract_packed(
+    job_id: int,
+    docs: List[Tuple[str, Path, str, FileTechnical]],
+    schema: CompiledSchema,
+    **call_kwargs: Any,
+) -> Dict[str, Any]:
+    """
+    Pool task: one request for several small files. Files the model skipped
+    (or whose record was cut off) get their own call. Returns {doc_id: record
+    dict or Exception}.
+    """
+    # same num_ctx as every other call of the job (no model reload); the answer gets
+    # the context left after the prompt, which the packer sized for one answer per file
+    packed_kwargs = {k: v for k, v in call_kwargs.items() if k != "num_predict"}
+    names = "+".join(fp.name for _, fp, _, _ in docs)
+    try:
+        # usage of the shared request belongs to no single file
+        out: Dict[str, Any] = dict(call_ollama_packed(
+            docs=[(doc_id, text, tech) for doc_id, _, text, tech in docs],
+            schema=schema,
+            on_usage=_usage_recorder(job_id, None, None),
+            **packed_kwargs,
+        ))
+    except Exception as e:
+        print(f"Packed request failed for {names}: {e}")
+        out = {}
+    for doc_id, fp, text, tech in docs:
+        if doc_id in out:
+            continue
+        try:
+            out[doc_id] = call_ollama_structured(
+                content=text, schema=schema, technical=tech, on_usage=_usage_recorder(job_id, fp.name, 0), **call_kwargs
+            )
+        except Exception as e:
+            out[doc_id] = e
+    return out
+
+
+class _SmallFilePacker:
+    """
+    Collects small files and sends them to the model max_docs at a time (and
+    at most max_chars of text per request). add() returns a per-file Future
+    that resolves to that file's record dict once its pack is answered.
+    """
+
+    def __init__(self, pool: OllamaCallPool, job_id: int, schema: CompiledSchema, max_docs: int, max_chars: int, **call_kwargs: Any):
+        self.pool = pool
+        self.job_id = job_id
+        self.schema = schema
+        self.max_docs = max(1, min(int(max_docs), packed_doc_limit(schema, max_chars, call_kwargs.get("num_ctx"))))
+        self.max_chars = int(max_chars)
+        self.call_kwargs = call_kwargs
+        self._docs: List[Tuple[str, Path, str, FileTechnical]] = []
+        self._futures: Dict[str, Future] = {}
+        self._chars = 0
+
+    def add(self, fp: Path, text: str, tech: FileTechnical) -> Future:
+        if self._docs and self._chars + len(text) > self.max_chars:
+            self.flush()
+        doc_id = f"d{len(self._docs) + 1}"
+        fut: Future = Future()
+        self._docs.append((doc_id, fp, text, tech))
+        self._futures[doc_id] = fut
+        self._chars += len(text)
+        if len(self._docs) >= self.max_docs:
+            self.flush()
+        return fut
+
+    def holds(self, fut: Future) -> bool:
+        return any(f is fut for f in self._futures.values())
+
+    def flush(self) -> None:
+        if not self._docs:
+            return
+        docs, futures = self._docs, self._futures
+        self._docs, self._futures, self._chars = [], {}, 0
+        task = self.pool.submit(_extract_packed, self.job_id, docs, self.schema, **self.call_kwargs)
+
+        def distribute(t: Future) -> None:
+            try:
+                results = t.result()
+            except Exception as e:
+                results = {doc_id: e for doc_id in futures}
+            for doc_id, f in futures.items():
+                res = results.get(doc_id)
+                if isinstance(res, Exception):
+                    f.set_exception(res)
+                else:
+                    f.set_result(res or {})
+
+        task.add_done_callback(distribute)
+
+
+def _escalate(
+    job_id: int,
+    fp: Path,
+    chunks: List[str],
+    chunk_dicts: List[Dict[str, Any]],
+    merged: Dict[str, Any],
+    schema: CompiledSchema,
+    pool: OllamaCallPool,
+    escalation_model: str,
+    call_kwargs: Dict[str, Any],
+    must_fill: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """
+    Cascade step: re-extract the fields the first model got wrong (missing,
+    invalid or conflicting) with `escalation_model`, using only those fields'
+    sub-schema and only the chunks that matter for them.
+    """
+    fields = escalation_fields(merged, chunk_dicts, schema, must_fill)
+    if not fields:
+        return merged
+
+    missing = set(missing_fields(merged, fields))
+    relevant = set()
+    for key in fields:
+        if key in missing:
+            # nobody found it: look at every chunk
+            relevant.update(range(len(chunks)))
+        else:
+            # invalid/conflicting: the chunks that produced a value
+            relevant.update(i for i, d in enumerate(chunk_dicts) if not missing_fields(d, [key]))
+    idxs = sorted(i for i in relevant if i < len(chunks))
+
+    sub = compile_schema(schema.subschema(fields))
+    kwargs = dict(
+        call_kwargs,
+        model=escalation_model,
+        num_predict=generation_sizes(sub, max(len(chunks[i]) for i in idxs))[1],
+    )
+    futures = [
+        call_ollama_structured_async(
+            pool, content=chunks[i], schema=sub, on_usage=_usage_recorder(job_id, fp.name, i), **kwargs
+        )
+        for i in idxs
+    ]
+    answers = []
+    for i, fut in zip(idxs, futures):
+        try:
+            answers.append(fut.result())
+        except Exception as e:
+            print(f"Escalation model failed on chunk {i+1} of {fp.name}: {e}")
+
+    better = aggregate_chunk_dicts(answers, schema=sub)
+    improved = [k for k in fields if not missing_fields(better, [k])]
+    for k in improved:
+        merged[k] = better[k]
+    print(f"Escalated {fp.name} to {escalation_model}: {', '.join(fields)} ({len(improved)} improved, {len(idxs)} chunks)")
+    return merged
+
+
+def _finish_file(
+    job_id: int,
+    fp: Path,
+    tech_dict: Dict[str, Any],
+    filetype_guess: str,
+    futures: List[Future],
+    chunks: List[str],
+    call_kwargs: Dict[str, Any],
+    *,
+    schema: CompiledSchema,
+    pool: Optional[OllamaCallPool] = None,
+    escalation_model: Optional[str] = None,
+    escalation_must_fill: Optional[List[str]] = None,
+) -> None:
+    """
+    Wait for a file's chunk calls (in chunk order), aggregate and save the record.
+    A file where every model call failed (outage, open circuit, missing model)
+    is not saved, so a resumed job processes it again.
+    """
+    try:
+        chunk_dicts = []
+        answered = 0
+        for idx, fut in enumerate(futures):
+            try:
+                res = fut.result()
+            except Exception as e:
+                print(f"Model failed on chunk {idx+1} of {fp.name}: {e}")
+                chunk_dicts.append({})
+                continue
+            answered += 1
+            # early-stop tasks return all chunk dicts of the file at once
+            if isinstance(res, list):
+                chunk_dicts.extend(res)
+            else:
+                chunk_dicts.append(res)
+
+        if not answered:
+            print(f"Failed on {fp.name}: no model call succeeded; left for the next run")
+            return
+
+        merged = aggregate_chunk_dicts(
+            chunk_dicts,
+            schema=schema,
+            technical=tech_dict,
+            filetype_guess=filetype_guess
+        )
+
+        if escalation_model and pool is not None:
+            merged = _escalate(
+                job_id, fp, chunks, chunk_dicts, merged, schema, pool, escalation_model, call_kwargs, escalation_must_fill
+            )
+
+        save_record(job_id, fp.name, merged, path=tech_dict["path"], sha256=tech_dict["sha256"])
+        increment_job_files_done(job_id)
+    except Exception as e:
+        print(f"Failed on {fp.name}: {e}")
+
+
 def process_job(
     job_id: int,
     root_dir: str,
@@ -28,70 +378,193 @@ def process_job(
     timeout_s: int = 180,
     max_files: int = 200,
     schema: Optional[Dict[str, Any]] = None,
+    extract_workers: int = 1,
+    llm_concurrency: int = 1,
+    extraction_mode: str = "chunks",
+    retrieval_top_k: int = 3,
+    early_stop: bool = False,
+    early_stop_fields: Optional[List[str]] = None,
+    stream: bool = False,
+    keep_alive: Optional[str] = OLLAMA_KEEP_ALIVE,
+    escalation_model: Optional[str] = None,
+    escalation_must_fill: Optional[List[str]] = None,
+    pack_max_chars: int = 0,
+    pack_max_docs: int = 6,
 ) -> None:
     """
     Process exactly one job id: scan files, chunk, call model, aggregate, save records.
+    Resumable: files with a saved record for the same path + sha256 are skipped.
     IMPORTANT: This module does NOT start/own any background worker loop.
     A separate process (worker.py) should call this function.
+
+    extract_workers > 1 moves text extraction + hashing into a process pool
+    that runs ahead of the LLM stage.
+    llm_concurrency bounds the number of in-flight model calls, shared by the
+    chunks of one file and across files. Chunk results are still aggregated in
+    chunk order and records are saved in file order.
+    extraction_mode="retrieval" sends only the preprocessed embed chunks most
+    similar to each schema property (top retrieval_top_k); files without
+    preprocess embeddings fall back to the first max_chunks chunks.
+    early_stop processes a file's chunks one by one and stops calling the model
+    once early_stop_fields (default: required fields except concat fields like
+    description) are all non-empty in the running aggregate.
+    stream=True uses streaming generation (early close + partial results on timeout).
+    keep_alive is sent with every call; the model and the job's prompt prefix
+    are warmed up once before the first file.
+    escalation_model enables the model cascade: model_tag handles every chunk,
+    and only fields that end up missing (escalation_must_fill, default: required
+    fields that are neither nullable nor arrays), invalid (enum/format/pattern)
+    or conflicting across chunks are re-extracted with escalation_model.
+    pack_max_chars > 0 packs files with at most that much text (capped at
+    chunk_size) into shared requests (up to pack_max_docs files, chunk_size
+    chars per request); the answer has one record per file, saved as usual.
     """
     schema = schema or DEFAULT_SCHEMA
+    # schema handling (types, merge modes, identity keys) derived once for all chunks/files
+    compiled = compile_schema(schema)
+
+    # chunks must fit the largest num_ctx, or Ollama silently cuts the prompt
+    fit = max_chunk_chars(compiled)
+    if int(chunk_size) > fit:
+        print(f"[job {job_id}] chunk_size {chunk_size} does not fit the model context; using {fit}")
+        chunk_size = fit
 
     files = walk_files(Path(root_dir))
     files = files[: max(0, int(max_files))]
     set_job_total_files(job_id, len(files))
 
-    for fp in files:
-        print(f"[job {job_id}] processing file: {fp}")
-        try:
-            text = extract_text(fp)
-            tech = FileTechnical(
-                path=str(fp),
-                filename=fp.name,
-                extension=fp.suffix.lower(),
-                size_bytes=fp.stat().st_size,
-                sha256=sha256_file(fp),
-            )
-            filetype_guess = fp.suffix.lower().lstrip(".")
+    # Resume: skip files that already have a checkpointed record (same path + content)
+    total = len(files)
+    completed = get_completed_files(job_id)
+    if completed:
+        files = [fp for fp in files if not _is_completed(fp, completed)]
+        print(f"[job {job_id}] resuming: {total - len(files)} file(s) already done")
+    set_job_files_done(job_id, total - len(files))
+
+    llm_concurrency = max(1, int(llm_concurrency))
+    set_http_pool_size(llm_concurrency)
+    retriever = None
+    if extraction_mode == "retrieval":
+        retriever = PropertyRetriever(
+            schema,
+            top_k=retrieval_top_k,
+            max_chunks=max_chunks,
+            chunk_size=chunk_size,
+            timeout_s=min(60, int(timeout_s)),
+            on_usage=_usage_recorder(job_id, None, None),
+        )
+        if files:
+            # embedding work first (with the models the preprocess jobs used), so the
+            # generation model isn't swapped out mid-job
+            try:
+                retriever.prepare(retriever.preprocess_models() or None)
+            except Exception as e:
+                print(f"[job {job_id}] embedding retrieval queries failed: {e}")
+
+    # one num_ctx for the whole job (sized for its largest chunk) so the model isn't reloaded
+    num_ctx, num_predict = generation_sizes(compiled, chunk_size)
 
-            # Empty/unextractable text: still store technical record
-            if not text.strip():
-                rec = ArchiveMetadata(technical=tech, filetype=filetype_guess)
-                save_record(job_id, fp.name, model_to_dict(rec))
-                increment_job_files_done(job_id)
+    if files:
+        usage = warm_up_model(model_tag, prefix=extraction_prefix(compiled), keep_alive=keep_alive, num_ctx=num_ctx)
+        if usage:
+            _usage_recorder(job_id, None, None)(usage)
+
+    stop_fields = list(early_stop_fields or default_stop_fields(compiled)) if early_stop else []
+
+    # (path, technical, filetype, chunk futures, chunks, call kwargs) of files whose calls are in flight
+    pending: Deque[Tuple[Path, Dict[str, Any], str, List[Future], List[str], Dict[str, Any]]] = deque()
+    finish = dict(
+        schema=compiled,
+        escalation_model=escalation_model if escalation_model != model_tag else None,
+        escalation_must_fill=escalation_must_fill,
+    )
+
+    base_kwargs = dict(
+        model=model_tag,
+        timeout_s=timeout_s,
+        stream=stream,
+        keep_alive=keep_alive,
+        num_ctx=num_ctx,
+        num_predict=num_predict,
+    )
+    # a "small" file is sent whole, so it must not be larger than a chunk
+    pack_max_chars = min(int(pack_max_chars), int(chunk_size))
+    packing = pack_max_chars > 0
+    # packed files wait in the packer, so allow a pack's worth of extra files in flight
+    max_pending = llm_concurrency + (int(pack_max_docs) if packing else 0)
+
+    with OllamaCallPool(llm_concurrency) as pool:
+        packer = _SmallFilePacker(pool, job_id, compiled, pack_max_docs, chunk_size, **base_kwargs) if packing else None
+        for fp, text, tech_dict, err in _iter_prepared(files, int(extract_workers)):
+            print(f"[job {job_id}] processing file: {fp}")
+            if err is not None:
+                print(f"Failed on {fp.name}: {err}")
                 continue
+            try:
+                tech = FileTechnical(**tech_dict)
+                filetype_guess = fp.suffix.lower().lstrip(".")
 
-            chunks = chunk_text(
-                text,
-                chunk_size=chunk_size,
-                overlap=chunk_overlap,
-                max_chunks=max_chunks,
-            )
-            #print(chunks)
-            
-            chunk_dicts = []
-            for idx, ch in enumerate(chunks):
-                try:
-                    recd = call_ollama_structured(
-                        model=model_tag,
-                        content=ch,
-                        schema=schema,          # <-- job schema
-                        technical=tech,
-                        timeout_s=timeout_s,
-                    )
-                    chunk_dicts.append(recd)
-                except Exception as e:
-                    print(f"Model failed on chunk {idx+1} of {fp.name}: {e}")
-
-            merged = aggregate_chunk_dicts(
-                chunk_dicts,
-                schema=schema,
-                technical=model_to_dict(tech),
-                filetype_guess=filetype_guess
-            )
+                # Empty/unextractable text: still store technical record
+                if not text.strip():
+                    rec = ArchiveMetadata(technical=tech, filetype=filetype_guess)
+                    save_record(job_id, fp.name, model_to_dict(rec), path=tech_dict["path"], sha256=tech_dict["sha256"])
+                    increment_job_files_done(job_id)
+                    continue
 
-            save_record(job_id, fp.name, merged)
-            increment_job_files_done(job_id)
+                call_kwargs = dict(base_kwargs, technical=tech)
+                if packer is not None and len(text.strip()) <= pack_max_chars:
+                    # small file: shares one request with other small files
+                    chunks = [text]
+                    futures = [packer.add(fp, text, tech)]
+                else:
+                    chunks = retriever.select_chunks(tech_dict["sha256"]) if retriever else []
+                    if not chunks:
+                        chunks = chunk_text(
+                            text,
+                            chunk_size=chunk_size,
+                            overlap=chunk_overlap,
+                            max_chunks=max_chunks,
+                        )
 
-        except Exception as e:
-            # Keep behavior: log and continue to next file
-            print(f"Failed on {fp.name}: {e}")
+                    if stop_fields:
+                        # one sequential task per file; files still run concurrently
+                        futures = [
+                            pool.submit(
+                                _extract_until_filled,
+                                job_id,
+                                fp,
+                                chunks,
+                                stop_fields,
+                                compiled,
+                                tech_dict,
+                                filetype_guess,
+                                **call_kwargs,
+                            )
+                        ]
+                    else:
+                        futures = [
+                            call_ollama_structured_async(
+                                pool,
+                                content=ch,
+                                schema=compiled,        # <-- job schema
+                                on_usage=_usage_recorder(job_id, fp.name, idx),
+                                **call_kwargs,
+                            )
+                            for idx, ch in enumerate(chunks)
+                        ]
+                pending.append((fp, tech_dict, filetype_guess, futures, chunks, call_kwargs))
+
+            except Exception as e:
+                # Keep behavior: log and continue to next file
+                print(f"Failed on {fp.name}: {e}")
+
+            # Save finished files in order; don't let more than max_pending files wait
+            while pending and (len(pending) > max_pending or all(f.done() for f in pending[0][3])):
+                if packer is not None and packer.holds(pending[0][3][0]):
+                    packer.flush()
+                _finish_file(job_id, *pending.popleft(), pool=pool, **finish)
+
+        if packer is not None:
+            packer.flush()
+        while pending:
+            _finish_file(job_id, *pending.popleft(), pool=pool, **finish)
@@ -0,0 +1,96 @@
+from __future__ import annotations
+import os
+import select
+import socket
+import time
+from pathlib import Path
+from typing import Optional
+
+from .config import WAKE_DIR
+
+# Local wake-up channel between the UI (create_job) and idle workers.
+# Each worker binds a Unix datagram socket in WAKE_DIR; notify_workers() sends
+# one datagram to every socket found there. Where AF_UNIX is unavailable the
+# worker just falls back to polling.
+
+_HAS_UNIX = hasattr(socket, "AF_UNIX")
+
+
+def notify_workers() -> None:
+    """Wake all idle workers on this host. Never raises."""
+    if not _HAS_UNIX or not WAKE_DIR.exists():
+        return
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    except Exception:
+        return
+    try:
+        sock.setblocking(False)
+        for p in WAKE_DIR.glob("*.sock"):
+            try:
+                sock.sendto(b"job", str(p))
+            except (ConnectionRefusedError, FileNotFoundError):
+                # worker is gone; clean up its socket file
+                try:
+                    p.unlink()
+                except Exception:
+                    pass
+            except Exception:
+                pass
+    finally:
+        sock.close()
+
+
+class JobWaiter:
+    """
+    Blocks an idle worker until notify_workers() is called or `timeout` passes.
+    """
+
+    def __init__(self, name: Optional[str] = None):
+        self.path: Optional[Path] = None
+        self.sock: Optional[socket.socket] = None
+        if not _HAS_UNIX:
+            return
+        try:
+            WAKE_DIR.mkdir(parents=True, exist_ok=True)
+            path = WAKE_DIR / f"{name or os.getpid()}.sock"
+            path.unlink(missing_ok=True)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(str(path))
+            sock.setblocking(False)
+            self.path, self.sock = path, sock
+        except Exception:
+            self.path, self.sock = None, None
+
+    def wait(self, timeout: float) -> bool:
+        """Return True if woken by a notification, False on timeout."""
+        if self.sock is None:
+            time.sleep(timeout)
+            return False
+        ready, _, _ = select.select([self.sock], [], [], timeout)
+        if not ready:
+            return False
+        # drain everything queued so one wake-up covers a burst of new jobs
+        try:
+            while self.sock.recv(64):
+                pass
+        except Exception:
+            pass
+        return True
+
+    def close(self) -> None:
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        if self.path is not None:
+            try:
+                self.path.unlink()
+            except Exception:
+                pass
+            self.path = None
+
+    def __enter__(self) -> "JobWaiter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -1,12 +1,35 @@
 from __future__ import annotations
+import copy
 import json
+import random
+import threading
 import time
-from typing import Dict, Any, Optional, List
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Any, Optional, List, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
 
-from .config import OLLAMA_BASE, CACHE_DIR
+from .config import (
+    OLLAMA_BACKENDS,
+    CACHE_DIR,
+    OLLAMA_CONNECT_TIMEOUT_S,
+    OLLAMA_HTTP_POOL_SIZE,
+    OLLAMA_MAX_CONCURRENCY,
+    OLLAMA_CTX_BUCKETS,
+    OLLAMA_PREDICT_BUCKETS,
+    OLLAMA_CASSETTE,
+    OLLAMA_CASSETTE_MODE,
+    OLLAMA_CASSETTE_LATENCY,
+)
+from .backends import BackendPool, BackendUnavailable
+from .cassette import REPLAY, Cassette
 from .schemas import ArchiveMetadata, FileTechnical, model_to_dict
+from .cache import cache_key, cache_get, cache_put
+from .aggregation import CONCAT_KEYS, CompiledSchema, compile_schema
+
+# Bump when the extraction prompt changes, so cached results are not reused.
+PROMPT_VERSION = "2"
 
 
 # A sane default schema (your UI can still pass its own)
@@ -64,81 +87,460 @@ DEFAULT_SCHEMA: Dict[str, Any] = {
 }
 
 
-def ensure_ollama_ready(model: str, timeout_s: int = 8) -> bool:
+# -----------------------
+# Shared HTTP client (keep-alive pool for all Ollama calls)
+# -----------------------
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+_pool_size = OLLAMA_HTTP_POOL_SIZE
+
+
+def _mount(sess: requests.Session, size: int) -> None:
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=size)
+    sess.mount("http://", adapter)
+    sess.mount("https://", adapter)
+
+
+def _http() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                sess = requests.Session()
+                _mount(sess, _pool_size)
+                _session = sess
+    return _session
+
+
+def set_http_pool_size(size: int) -> None:
+    """Grow the keep-alive pool to match the number of concurrent callers (never shrinks)."""
+    global _pool_size
+    size = max(1, int(size))
+    with _session_lock:
+        if size <= _pool_size:
+            return
+        _pool_size = size
+        if _session is not None:
+            _mount(_session, size)
+
+
+def _timeout(read_s: float) -> Tuple[float, float]:
+    """(connect, read) timeout: fail fast on a dead host, wait `read_s` for the model."""
+    return (float(OLLAMA_CONNECT_TIMEOUT_S), float(read_s))
+
+
+def _raise_for_status(r: requests.Response) -> None:
+    """raise_for_status, marking 4xx errors as the request's fault rather than the backend's."""
     try:
-        resp = requests.get(f"{OLLAMA_BASE}/api/tags", timeout=int(timeout_s))
-        tags = resp.json()
-        return any(t.get("name") == model for t in tags.get("models", []))
-    except Exception:
+        r.raise_for_status()
+    except requests.HTTPError as e:
+        e.backend_ok = r.status_code < 500  # type: ignore[attr-defined]
+        raise
+
+
+def _is_retryable(e: Exception) -> bool:
+    """
+    Retry only what can succeed on a second try: timeouts, connection errors,
+    429 and 5xx. Bad requests (4xx), an open circuit and parse errors are final
+    (during an outage the file fails fast and a resumed job picks it up again).
+    """
+    if isinstance(e, BackendUnavailable):
         return False
+    if isinstance(e, requests.HTTPError):
+        code = e.response.status_code if e.response is not None else 0
+        return code == 429 or code >= 500
+    return isinstance(e, (requests.ConnectionError, requests.Timeout))
+
+
+def _backoff_sleep(attempt: int) -> None:
+    """Exponential back-off (2, 4, 8s) with jitter, so workers don't retry in lockstep."""
+    time.sleep(min(2 ** (attempt + 1), 8) * random.uniform(0.5, 1.0))
+
+
+# -----------------------
+# Backend pool (one or more Ollama servers)
+# -----------------------
+
+_pool: Optional[BackendPool] = None
+_pool_lock = threading.Lock()
+
+
+def _fetch_tags(url: str, timeout_s: float) -> Dict[str, Any]:
+    r = _http().get(f"{url}/api/tags", timeout=_timeout(timeout_s))
+    r.raise_for_status()
+    return r.json()
+
+
+def _backends() -> BackendPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = BackendPool(list(OLLAMA_BACKENDS), _fetch_tags, max_concurrency=OLLAMA_MAX_CONCURRENCY)
+    return _pool
+
+
+def configure_backends(urls: List[str], **kwargs: Any) -> BackendPool:
+    """Replace the backend pool (e.g. to point at other Ollama servers)."""
+    global _pool
+    kwargs.setdefault("max_concurrency", OLLAMA_MAX_CONCURRENCY)
+    with _pool_lock:
+        _pool = BackendPool(list(urls), _fetch_tags, **kwargs)
+    return _pool
+
+
+def backend_status() -> List[Dict[str, Any]]:
+    return _backends().status()
 
 
 def list_ollama_models(timeout_s: int = 8) -> List[str]:
-    try:
-        resp = requests.get(f"{OLLAMA_BASE}/api/tags", timeout=int(timeout_s))
-        tags = resp.json()
-        return [m.get("name") for m in tags.get("models", []) if m.get("name")]
-    except Exception:
-        return []
+    """Models available on any healthy backend."""
+    pool = _backends()
+    pool.health_check(timeout_s)
+    models: set = set()
+    for b in pool.backends:
+        if b.healthy:
+            models |= b.models
+    return sorted(models)
 
-def _ollama_embed(text: str, model: str, timeout_s: int = 60, retries: int = 3) -> Optional[List[float]]:
+
+def ensure_ollama_ready(model: str, timeout_s: int = 8) -> bool:
+    return model in list_ollama_models(timeout_s=timeout_s)
+
+
+def loaded_models(timeout_s: int = 2) -> List[str]:
+    """Models currently loaded in memory on any backend (GET /api/ps); [] if unknown."""
+    names: set = set()
+    for b in _backends().backends:
+        try:
+            r = _http().get(f"{b.url}/api/ps", timeout=_timeout(timeout_s))
+            r.raise_for_status()
+            names |= {m.get("name") or m.get("model") for m in r.json().get("models", [])}
+        except Exception:
+            continue
+    names.discard(None)
+    return sorted(names)
+
+# -----------------------
+# Record / replay
+# -----------------------
+
+_cassette: Optional[Cassette] = (
+    Cassette(OLLAMA_CASSETTE, OLLAMA_CASSETTE_MODE, replay_latency=OLLAMA_CASSETTE_LATENCY) if OLLAMA_CASSETTE else None
+)
+
+
+def use_cassette(path: Optional[Any], mode: str = REPLAY, *, replay_latency: bool = False) -> Optional[Cassette]:
     """
-    Try Ollama embedding endpoints. Returns list[float] or None.
-    Supports common Ollama API variants:
-      - POST /api/embeddings  {"model": "...", "prompt": "..."}
-      - POST /api/embed       {"model": "...", "input": "..."}
+    Record ("record") or replay ("replay") all generate/embed traffic to/from the
+    cassette file at `path`; path=None switches back to live requests.
     """
-    backoff = 2
-    last_err: Optional[Exception] = None
+    global _cassette
+    _cassette = Cassette(path, mode, replay_latency=replay_latency) if path else None
+    return _cassette
 
-    payloads = [
-        (f"{OLLAMA_BASE}/api/embeddings", {"model": model, "prompt": text}),
-        (f"{OLLAMA_BASE}/api/embed", {"model": model, "input": text}),
-    ]
 
-    for _ in range(max(1, int(retries))):
-        for url, payload in payloads:
-            try:
-                r = requests.post(url, json=payload, timeout=int(timeout_s))
-                r.raise_for_status()
+def _via_cassette(endpoint: str, payload: Dict[str, Any], send: Callable[[], Any]) -> Any:
+    c = _cassette
+    if c is None:
+        return send()
+    client: Dict[str, Any] = {}
+
+    def live() -> Any:
+        data = send()
+        if isinstance(data, dict) and "_client" in data:
+            data = dict(data)
+            client.update(data.pop("_client"))   # per-run timing; not part of the recording
+        return data
+
+    t0 = time.monotonic()
+    data = c.call(endpoint, payload, live)
+    if isinstance(data, dict):
+        data = dict(data, _client=client or {"backend": "cassette", "wait_s": 0.0, "wall_s": time.monotonic() - t0})
+    return data
+
+# Which embedding endpoint each server supports: "embed" (batched) or "embeddings" (legacy)
+_embed_endpoint: Dict[str, str] = {}
+
+EMBED_BATCH_MAX_CHARS = 24000
+EMBED_BATCH_MAX_ITEMS = 64
+
+
+def _parse_embeddings(data: Dict[str, Any]) -> List[List[float]]:
+    """
+    Common response shapes:
+      {"embeddings":[[...], ...]}, {"embedding":[...]}, {"data":[{"embedding":[...]}]}
+    """
+    embs = data.get("embeddings")
+    if isinstance(embs, list) and embs and isinstance(embs[0], list):
+        return embs
+    if isinstance(data.get("embedding"), list):
+        return [data["embedding"]]
+    if isinstance(data.get("data"), list):
+        # OpenAI-ish
+        return [d.get("embedding") for d in data["data"] if isinstance(d.get("embedding"), list)]
+    return []
+
+
+def _embed_legacy(base: str, texts: List[str], model: str, timeout_s: int) -> Dict[str, Any]:
+    out: List[List[float]] = []
+    for t in texts:
+        r = _http().post(f"{base}/api/embeddings", json={"model": model, "prompt": t}, timeout=_timeout(timeout_s))
+        _raise_for_status(r)
+        embs = _parse_embeddings(r.json())
+        if not embs:
+            raise ValueError("empty embedding response")
+        out.append(embs[0])
+    return {"embeddings": out}
+
+
+def _embed_batch(texts: List[str], model: str, timeout_s: int) -> Dict[str, Any]:
+    """Embed one batch (recorded/replayed when a cassette is active)."""
+    return _via_cassette("embed", {"model": model, "input": texts}, lambda: _embed_batch_http(texts, model, timeout_s))
+
+
+def _embed_batch_http(texts: List[str], model: str, timeout_s: int) -> Dict[str, Any]:
+    """
+    Embed one batch, using the endpoint this server is known to support.
+    Returns the response with "embeddings" (one per text) and Ollama's timing fields.
+    """
+    t_req = time.monotonic()
+    with _backends().route(model) as b:
+        t_sent = time.monotonic()
+        base = b.url
+        if _embed_endpoint.get(base) == "embeddings":
+            data = _embed_legacy(base, texts, model, timeout_s)
+        else:
+            r = _http().post(f"{base}/api/embed", json={"model": model, "input": texts}, timeout=_timeout(timeout_s))
+            if r.status_code == 404 and base not in _embed_endpoint:
+                # older Ollama without /api/embed (or unknown model: then legacy fails too)
+                data = _embed_legacy(base, texts, model, timeout_s)
+                _embed_endpoint[base] = "embeddings"
+            else:
+                _raise_for_status(r)
                 data = r.json()
+                data["embeddings"] = _parse_embeddings(data)
+                if len(data["embeddings"]) != len(texts):
+                    raise ValueError(f"expected {len(texts)} embeddings, got {len(data['embeddings'])}")
+                _embed_endpoint[base] = "embed"
+        data["_client"] = {"backend": base, "wait_s": t_sent - t_req, "wall_s": time.monotonic() - t_sent}
+        return data
+
 
-                # common shapes:
-                # {"embedding":[...]} or {"embeddings":[[...]]}
-                if isinstance(data.get("embedding"), list):
-                    return data["embedding"]
-                embs = data.get("embeddings")
-                if isinstance(embs, list) and embs and isinstance(embs[0], list):
-                    return embs[0]
-                if isinstance(data.get("data"), list) and data["data"]:
-                    # OpenAI-ish: {"data":[{"embedding":[...]}]}
-                    e = data["data"][0].get("embedding")
-                    if isinstance(e, list):
-                        return e
+def _embed_batches(texts: List[str], max_chars: int, max_items: int) -> List[List[int]]:
+    """Group text indices so each request stays under max_chars / max_items."""
+    batches: List[List[int]] = []
+    cur: List[int] = []
+    cur_chars = 0
+    for i, t in enumerate(texts):
+        if cur and (cur_chars + len(t) > max_chars or len(cur) >= max_items):
+            batches.append(cur)
+            cur, cur_chars = [], 0
+        cur.append(i)
+        cur_chars += len(t)
+    if cur:
+        batches.append(cur)
+    return batches
 
+
+def embed_many(
+    texts: List[str],
+    model: str,
+    *,
+    timeout_s: int = 60,
+    retries: int = 3,
+    max_batch_chars: int = EMBED_BATCH_MAX_CHARS,
+    max_batch_items: int = EMBED_BATCH_MAX_ITEMS,
+    on_usage: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> List[Optional[List[float]]]:
+    """
+    Embed many texts with batched /api/embed requests. Batch size adapts to the
+    payload length. Returns one vector per text, None where a batch kept failing.
+    on_usage receives token counts and timings (incl. model load) per batch.
+    """
+    out: List[Optional[List[float]]] = [None] * len(texts)
+    for idxs in _embed_batches(texts, int(max_batch_chars), int(max_batch_items)):
+        batch = [texts[i] for i in idxs]
+        for attempt in range(max(1, int(retries))):
+            try:
+                data = _embed_batch(batch, model, timeout_s)
+                for i, vec in zip(idxs, data["embeddings"]):
+                    out[i] = vec
+                _report(on_usage, _usage(data, "embed", model))
+                break
             except Exception as e:
-                last_err = e
-                continue
+                print(f"Embedding batch of {len(batch)} failed: {e}")
+                if not _is_retryable(e) or attempt + 1 >= max(1, int(retries)):
+                    break
+                _backoff_sleep(attempt)
+    return out
 
-        time.sleep(backoff)
-        backoff = min(backoff * 2, 8)
 
-    # Optional: log last_err somewhere
-    return None
+def _ollama_embed(text: str, model: str, timeout_s: int = 60, retries: int = 3) -> Optional[List[float]]:
+    """Embed a single text. Returns list[float] or None."""
+    return embed_many([text], model, timeout_s=timeout_s, retries=retries)[0]
 
 def _ollama_generate(payload: Dict[str, Any], timeout_s: int, retries: int = 3) -> Dict[str, Any]:
-    backoff = 2
-    last_err: Optional[Exception] = None
-    for _ in range(max(1, int(retries))):
+    return _via_cassette("generate", payload, lambda: _generate_http(payload, timeout_s, retries))
+
+
+def _generate_http(payload: Dict[str, Any], timeout_s: int, retries: int) -> Dict[str, Any]:
+    attempts = max(1, int(retries))
+    for attempt in range(attempts):
         try:
-            r = requests.post(f"{OLLAMA_BASE}/api/generate", json=payload, timeout=int(timeout_s))
-            r.raise_for_status()
-            return r.json()
+            t_req = time.monotonic()
+            with _backends().route(payload.get("model")) as b:
+                t_sent = time.monotonic()
+                r = _http().post(f"{b.url}/api/generate", json=payload, timeout=_timeout(timeout_s))
+                _raise_for_status(r)
+                data = r.json()
+                data["_client"] = {"backend": b.url, "wait_s": t_sent - t_req, "wall_s": time.monotonic() - t_sent}
+                return data
+        except Exception as e:
+            if not _is_retryable(e) or attempt + 1 >= attempts:
+                raise
+            _backoff_sleep(attempt)
+    raise RuntimeError("unreachable")
+
+class _RootObjectScanner:
+    """
+    Incremental scanner over streamed JSON text: tracks string/escape state and
+    brace depth, and reports when the root object has closed.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.in_str = False
+        self.esc = False
+
+    def feed(self, text: str) -> bool:
+        """Consume text; return True once the root object is complete."""
+        for ch in text:
+            if self.in_str:
+                if self.esc:
+                    self.esc = False
+                elif ch == "\\":
+                    self.esc = True
+                elif ch == '"':
+                    self.in_str = False
+            elif ch == '"':
+                self.in_str = True
+            elif ch in "{[":
+                self.depth += 1
+                self.started = True
+            elif ch in "}]":
+                self.depth -= 1
+                if self.started and self.depth == 0:
+                    return True
+        return False
+
+
+def _ollama_generate_stream(payload: Dict[str, Any], timeout_s: int, retries: int = 3) -> Dict[str, Any]:
+    """
+    Streaming /api/generate. Stops reading as soon as the root JSON object is
+    complete. On timeout returns what was received with "partial": True
+    instead of raising, so well-formed fields can still be salvaged.
+    """
+    payload = dict(payload, stream=True)
+    return _via_cassette("generate", payload, lambda: _generate_stream_http(payload, timeout_s, retries))
+
+
+# After the root object closed, how long to keep reading for Ollama's final
+# "done" message (token counts, durations) before closing the stream
+_STREAM_DRAIN_S = 5.0
+
+
+def _generate_stream_http(payload: Dict[str, Any], timeout_s: int, retries: int) -> Dict[str, Any]:
+    attempts = max(1, int(retries))
+    for attempt in range(attempts):
+        parts: List[str] = []
+        last: Dict[str, Any] = {}
+        deadline = time.monotonic() + float(timeout_s)
+        client: Dict[str, Any] = {}
+        t_req = time.monotonic()
+        try:
+            with _backends().route(payload.get("model")) as b, _http().post(
+                f"{b.url}/api/generate", json=payload, timeout=_timeout(timeout_s), stream=True
+            ) as r:
+                t_sent = time.monotonic()
+                client.update(backend=b.url, wait_s=t_sent - t_req)
+                _raise_for_status(r)
+                scanner = _RootObjectScanner()
+                closed = False
+                drain_until = deadline
+                for line in r.iter_lines():
+                    if not line:
+                        continue
+                    last = json.loads(line)
+                    if not closed:
+                        piece = last.get("response") or ""
+                        parts.append(piece)
+                        if scanner.feed(piece):
+                            # answer complete; read on (briefly) for the final message with token counts
+                            closed = True
+                            drain_until = min(deadline, time.monotonic() + _STREAM_DRAIN_S)
+                    if last.get("done"):
+                        break
+                    if closed and time.monotonic() > drain_until:
+                        break
+                    if not closed and time.monotonic() > deadline:
+                        client["wall_s"] = time.monotonic() - t_sent
+                        return dict(last, response="".join(parts), done=False, partial=True, _client=client)
+                client["wall_s"] = time.monotonic() - t_sent
+            return dict(last, response="".join(parts), root_closed=closed, _client=client)
         except Exception as e:
-            last_err = e
-            time.sleep(backoff)
-            backoff = min(backoff * 2, 8)
-    raise last_err  # type: ignore
+            if parts:
+                # timed out / dropped mid-generation: keep the partial output
+                return dict(last, response="".join(parts), done=False, partial=True, _client=client)
+            if not _is_retryable(e) or attempt + 1 >= attempts:
+                raise
+            _backoff_sleep(attempt)
+    raise RuntimeError("unreachable")
+
+def _salvage_partial_json(s: str) -> Dict[str, Any]:
+    """
+    Recover the complete top-level fields of a truncated JSON object by cutting
+    at the last root-level comma and closing the object. When no top-level
+    field is complete (e.g. {"documents": [{...}, {...}, {"doc_id": ...), cut
+    between the elements of the root's first value instead, keeping whole elements.
+    """
+    start = s.find("{")
+    if start == -1:
+        return {}
+    stack: List[str] = []
+    in_str, esc = False, False
+    cuts: List[int] = []
+    inner: List[Tuple[int, str]] = []   # (cut, closing brackets) one level down
+    for i in range(start, len(s)):
+        ch = s[i]
+        if in_str:
+            if esc:
+                esc = False
+            elif ch == "\\":
+                esc = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+        elif ch == "," and len(stack) == 1:
+            cuts.append(i)
+        elif ch == "," and len(stack) == 2 and not cuts:
+            inner.append((i, "".join(reversed(stack))))
+    candidates = [(cut, "}") for cut in cuts] or inner
+    for cut, closing in reversed(candidates):
+        try:
+            obj = json.loads(s[start:cut] + closing)
+            return obj if isinstance(obj, dict) else {}
+        except Exception:
+            continue
+    return {}
 
 def _loose_json_extract(s: str) -> Dict[str, Any]:
     if not s:
@@ -166,55 +568,153 @@ def _loose_json_extract(s: str) -> Dict[str, Any]:
         return obj if isinstance(obj, dict) else {}
     except Exception:
         return {}
-    
-def call_ollama_structured(
-    model: str,
-    content: str,
-    schema: Dict[str, Any],
-    technical: FileTechnical,
-    *,
-    timeout_s: int = 180,
-    num_predict: int = 800,
-    num_ctx: int = 2048,
-) -> Dict[str, Any]:
+
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def _repair_json(s: str) -> Dict[str, Any]:
     """
-    Call Ollama with a JSON schema and return a dict that conforms to that schema.
-    Fully schema-driven. No ArchiveMetadata assumptions.
+    Local repair of almost-JSON model output, tried before asking the model again:
+    strips code fences and text around the object, converts single-quoted
+    strings and Python literals, drops trailing commas and closes unbalanced
+    strings/brackets. Returns {} if the result still doesn't parse to an object.
     """
+    start = s.find("{") if s else -1
+    if start == -1:
+        return {}
+    s = s[start:]
+    out: List[str] = []
+    stack: List[str] = []
+    quote: Optional[str] = None
+    esc = False
+    i = 0
+    while i < len(s):
+        ch = s[i]
+        if quote:
+            if esc:
+                esc = False
+                if ch == "'":
+                    out[-1] = ch    # \' is not a JSON escape
+                else:
+                    out.append(ch)
+            elif ch == "\\":
+                esc = True
+                out.append(ch)
+            elif ch == quote:
+                quote = None
+                out.append('"')
+            elif ch == '"':
+                out.append('\\"')     # double quote inside a single-quoted string
+            elif ch == "\n":
+                out.append("\\n")
+            else:
+                out.append(ch)
+        elif ch in "\"'":
+            quote = ch
+            out.append('"')
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            out.append(ch)
+        elif ch in "}]":
+            while out and out[-1] in " \t\r\n,":
+                out.pop()           # trailing comma
+            if stack:
+                out.append(stack.pop())
+            if not stack:
+                break               # end of the root object; ignore what follows
+        elif ch.isalpha():
+            j = i
+            while j < len(s) and (s[j].isalnum() or s[j] == "_"):
+                j += 1
+            word = s[i:j]
+            if s[j:].lstrip().startswith(":"):
+                out.append(f'"{word}"')    # unquoted key
+            else:
+                out.append(_PY_LITERALS.get(word, word))
+            i = j
+            continue
+        else:
+            out.append(ch)
+        i += 1
 
-    prompt = f"""
-    Je bent de Archiefassistent, een tool om archiefmedewerkers te helpen archiefstukken beter te beschrijven.
-    Extraheer metadata uit de tekst hieronder.
-
-    REGELS:
-    - Antwoord UITSLUITEND in valide JSON
-    - Gebruik alleen velden die in het schema voorkomen
-    - Waarden altijd in het Nederlands
-    - Onbekend of twijfelachtig → null of lege waarde
-    - Geen commentaar, geen uitleg
-
-    TEKST:
-    {content}
-    """.strip()
+    if quote:
+        out.append('"')
+    while out and out[-1] in " \t\r\n,:":
+        out.pop()
+    text = "".join(out) + "".join(reversed(stack))
+    try:
+        obj = json.loads(text)
+    except Exception:
+        return _salvage_partial_json(text)
+    return obj if isinstance(obj, dict) else {}
 
-    payload = {
+
+def _fit_to_schema(obj: Dict[str, Any], cs: CompiledSchema) -> Dict[str, Any]:
+    """Unwrap answers nested under a single key (e.g. {"metadata": {...}}) when the top level has no schema fields."""
+    if not obj or any(k in cs.props for k in obj):
+        return obj
+    for v in obj.values():
+        if isinstance(v, dict) and any(k in cs.props for k in v):
+            return v
+    return obj
+
+
+def _usage(data: Dict[str, Any], kind: str, model: str) -> Dict[str, Any]:
+    """Token counts and timings (ms) from an Ollama response, plus client-side timing."""
+    client = data.get("_client") or {}
+
+    def ms(ns: Any) -> Optional[float]:
+        return ns / 1e6 if isinstance(ns, (int, float)) else None
+
+    return {
+        "kind": kind,
         "model": model,
-        "format": schema,          # Ollama schema-constrained generation
-        "prompt": prompt,
-        "stream": False,
-        "options": {
-            "temperature": 0.0,
-            "repeat_penalty": 1.05,
-            "top_k": 40,
-            "top_p": 0.9,
-            "num_predict": int(num_predict),
-            "num_ctx": int(num_ctx),
-        },
+        "backend": client.get("backend"),
+        "cached": False,
+        "prompt_eval_count": data.get("prompt_eval_count"),
+        "eval_count": data.get("eval_count"),
+        "total_ms": ms(data.get("total_duration")),
+        "load_ms": ms(data.get("load_duration")),
+        "prompt_eval_ms": ms(data.get("prompt_eval_duration")),
+        "eval_ms": ms(data.get("eval_duration")),
+        "wait_ms": client["wait_s"] * 1000 if "wait_s" in client else None,
+        "wall_ms": client["wall_s"] * 1000 if "wall_s" in client else None,
     }
 
-    data = _ollama_generate(payload, timeout_s=timeout_s, retries=3)
+
+def _report(on_usage: Optional[Callable[[Dict[str, Any]], None]], usage: Dict[str, Any]) -> None:
+    if on_usage is None:
+        return
+    try:
+        on_usage(usage)
+    except Exception as e:
+        print(f"Recording model usage failed: {e}")
+
+
+def _generate_structured(
+    model: str,
+    payload: Dict[str, Any],
+    cs: CompiledSchema,
+    *,
+    timeout_s: int,
+    num_predict: int,
+    num_ctx: int,
+    on_usage: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Tuple[Dict[str, Any], bool]:
+    """
+    Run the generate request (+ repair pass). Returns (parsed JSON object or {},
+    complete) where complete=False marks an answer that was cut off (num_predict
+    reached, truncated stream) or had to be repaired; such answers aren't cached.
+    """
+    if payload.get("stream"):
+        data = _ollama_generate_stream(payload, timeout_s=timeout_s, retries=3)
+    else:
+        data = _ollama_generate(payload, timeout_s=timeout_s, retries=3)
     print(data)
+    _report(on_usage, _usage(data, "generate", model))
     raw = (data.get("response") or "").strip()
+    # a streamed answer whose root object closed is complete even if Ollama went on to num_predict
+    complete = data.get("done_reason") != "length" or bool(data.get("root_closed"))
 
     # --- Parse JSON ---
     try:
@@ -225,14 +725,26 @@ def call_ollama_structured(
     if not isinstance(obj, dict):
         obj = {}
 
+    # --- Cut off (num_predict reached, truncated stream): keep only the fields that
+    # did complete; repairing would close a half-written value and keep it ---
+    if not obj and (data.get("partial") or not complete):
+        return _fit_to_schema(_salvage_partial_json(raw), cs), False
+
+    # --- Local repair (fences, quotes, trailing commas, unclosed brackets) ---
+    if not obj and raw:
+        obj = _repair_json(raw)
+        complete = complete and not obj
+    obj = _fit_to_schema(obj, cs)
+
     # --- Repair pass if model ignored schema ---
     if not obj and raw:
+        complete = False
         prompt2 = f"""
         De assistent gaf ongeldige JSON terug.
         EXTRACTEER EN GEEF ALLEEN valide JSON terug dat overeenkomt met het schema.
 
         SCHEMA:
-        {json.dumps(schema, ensure_ascii=False, indent=2)}
+        {json.dumps(cs.schema, ensure_ascii=False, indent=2)}
 
         TEKST:
         {raw}
@@ -240,18 +752,20 @@ def call_ollama_structured(
 
         follow = {
             "model": model,
-            "format": schema,
+            "format": cs.schema,
             "prompt": prompt2,
             "stream": False,
             "options": {
                 "temperature": 0.0,
                 "num_predict": min(int(num_predict), 400),
-                "num_ctx": int(num_ctx),
+                # keep the job's num_ctx unless the repair prompt doesn't fit in it
+                "num_ctx": max(int(num_ctx), _bucket(_estimate_tokens(len(prompt2)) + 400, OLLAMA_CTX_BUCKETS)),
             },
         }
 
         try:
             data2 = _ollama_generate(follow, timeout_s=min(60, timeout_s), retries=2)
+            _report(on_usage, _usage(data2, "repair", model))
             raw2 = (data2.get("response") or "").strip()
             obj = json.loads(raw2) if raw2 else _loose_json_extract(raw2)
         except Exception:
@@ -274,70 +788,466 @@ def call_ollama_structured(
             pass
         obj = {}
 
-    # --- Schema-aware normalization ---
-    props = schema.get("properties") or {}
-    normalized: Dict[str, Any] = {}
+    return obj, complete
 
-    def schema_type(s: Dict[str, Any]) -> str:
-        t = s.get("type")
-        if isinstance(t, list):
-            nn = [x for x in t if x != "null"]
-            return nn[0] if nn else "string"
-        return t or "string"
+_prefix_cache: Dict[str, str] = {}
 
-    for key, prop_schema in props.items():
-        val = obj.get(key)
-        t = schema_type(prop_schema if isinstance(prop_schema, dict) else {})
 
-        if val is None:
-            normalized[key] = None
-            continue
+def extraction_prefix(schema: Any) -> str:
+    """
+    Instruction block + field list for a schema (dict or CompiledSchema). Identical
+    for every chunk of a job and the chunk text is appended after it, so Ollama can
+    reuse the evaluated prefix from its KV cache instead of re-reading it per chunk.
+    """
+    if isinstance(schema, CompiledSchema):
+        skey, schema = schema.schema_json, schema.schema
+    else:
+        skey = json.dumps(schema, ensure_ascii=False, sort_keys=True)
+    prefix = _prefix_cache.get(skey)
+    if prefix is not None:
+        return prefix
 
-        # Array normalization
-        if t == "array":
-            if isinstance(val, list):
-                normalized[key] = val
-            elif isinstance(val, str) and val.strip():
-                normalized[key] = [val.strip()]
-            else:
-                normalized[key] = []
-
-        # Object normalization
-        elif t == "object":
-            normalized[key] = val if isinstance(val, dict) else {}
-
-        # Boolean normalization
-        elif t == "boolean":
-            if isinstance(val, bool):
-                normalized[key] = val
-            elif isinstance(val, str):
-                v = val.strip().lower()
-                normalized[key] = v in ("true", "ja", "yes", "1")
-            else:
-                normalized[key] = None
+    fields = []
+    for key, ps in (schema.get("properties") or {}).items():
+        desc = ps.get("description") if isinstance(ps, dict) else None
+        fields.append(f"- {key}: {desc}" if desc else f"- {key}")
 
-        # Number / integer
-        elif t in ("number", "integer"):
-            try:
-                n = float(val)
-                normalized[key] = int(n) if t == "integer" else n
-            except Exception:
-                normalized[key] = None
+    prefix = "\n".join([
+        "Je bent de Archiefassistent, een tool om archiefmedewerkers te helpen archiefstukken beter te beschrijven.",
+        "Extraheer metadata uit de tekst onderaan.",
+        "",
+        "REGELS:",
+        "- Antwoord UITSLUITEND in valide JSON",
+        "- Gebruik alleen velden die in het schema voorkomen",
+        "- Waarden altijd in het Nederlands",
+        "- Onbekend of twijfelachtig → null of lege waarde",
+        "- Geen commentaar, geen uitleg",
+        "",
+        "VELDEN:",
+        *fields,
+        "",
+        "TEKST:",
+        "",
+    ])
+    _prefix_cache[skey] = prefix
+    return prefix
 
-        # String (default)
-        else:
-            normalized[key] = str(val).strip() if isinstance(val, str) else val
 
-    # --- Inject technical/filetype ONLY if schema expects them ---
-    if "technical" in props and not isinstance(normalized.get("technical"), dict):
+# -----------------------
+# Context / output sizing
+# -----------------------
+
+# Rough output size per property type (tokens, incl. key and punctuation)
+_TYPE_OUTPUT_TOKENS = {"string": 32, "array": 64, "object": 64, "number": 8, "integer": 8, "boolean": 6}
+_CONCAT_OUTPUT_TOKENS = 256   # concat fields (description, notes, ...) get long answers
+_CTX_MARGIN_TOKENS = 64
+
+_budget_cache: Dict[str, int] = {}
+
+
+def _estimate_tokens(chars: int) -> int:
+    """Conservative token estimate for Dutch/English text (~3 chars per token)."""
+    return int(chars) // 3 + 1
+
+
+def _bucket(n: int, buckets: Tuple[int, ...]) -> int:
+    for b in buckets:
+        if n <= b:
+            return b
+    return buckets[-1]
+
+
+def _output_budget(cs: CompiledSchema) -> int:
+    budget = _budget_cache.get(cs.schema_json)
+    if budget is None:
+        budget = 16 + sum(
+            _CONCAT_OUTPUT_TOKENS if key in CONCAT_KEYS else _TYPE_OUTPUT_TOKENS.get(t, 32)
+            for key, t in cs.types.items()
+        )
+        _budget_cache[cs.schema_json] = budget
+    return budget
+
+
+def generation_sizes(schema: Any, content_chars: int) -> Tuple[int, int]:
+    """
+    (num_ctx, num_predict) for an extraction call on `content_chars` characters:
+    num_predict from the schema's expected answer size, num_ctx from prompt +
+    answer, both rounded up to the configured buckets. Pass the largest chunk
+    size of a job to get one num_ctx for all its calls.
+    """
+    cs = compile_schema(schema)
+    num_predict = _bucket(_output_budget(cs), OLLAMA_PREDICT_BUCKETS)
+    prompt_tokens = _estimate_tokens(len(extraction_prefix(cs)) + int(content_chars))
+    needed = prompt_tokens + num_predict + _CTX_MARGIN_TOKENS
+    num_ctx = _bucket(needed, OLLAMA_CTX_BUCKETS)
+    if needed > num_ctx:
+        print(
+            f"[ollama] {content_chars} chars need ~{needed} tokens of context, more than the largest "
+            f"num_ctx ({num_ctx}); Ollama will truncate the prompt. Use chunks of at most {max_chunk_chars(cs)} chars."
+        )
+    return num_ctx, num_predict
+
+
+def max_chunk_chars(schema: Any) -> int:
+    """Largest chunk (chars) whose extraction call still fits in the largest num_ctx bucket."""
+    cs = compile_schema(schema)
+    num_predict = _bucket(_output_budget(cs), OLLAMA_PREDICT_BUCKETS)
+    room = OLLAMA_CTX_BUCKETS[-1] - num_predict - _CTX_MARGIN_TOKENS - 1
+    return max(0, room * 3 - len(extraction_prefix(cs)))
+
+
+def warm_up_model(
+    model: str,
+    *,
+    prefix: str = "",
+    keep_alive: Optional[str] = None,
+    num_ctx: int = 2048,
+    timeout_s: int = 300,
+) -> Optional[Dict[str, Any]]:
+    """
+    Load `model` (and evaluate `prefix`, if given, into the KV cache) before
+    real work starts. num_ctx must match the later calls, or Ollama reloads.
+    Returns the call's usage (tokens/timings, see _usage), or None if it failed.
+    """
+    payload: Dict[str, Any] = {
+        "model": model,
+        "prompt": prefix,
+        "stream": False,
+        "options": {"num_predict": 1, "num_ctx": int(num_ctx)},
+    }
+    if keep_alive:
+        payload["keep_alive"] = keep_alive
+    try:
+        t0 = time.monotonic()
+        data = _ollama_generate(payload, timeout_s=timeout_s, retries=1)
+        print(
+            f"[ollama] warm-up {model}: {time.monotonic() - t0:.1f}s "
+            f"(load {(data.get('load_duration') or 0) / 1e9:.1f}s, "
+            f"prompt_eval {(data.get('prompt_eval_duration') or 0) / 1e9:.2f}s for {data.get('prompt_eval_count') or 0} tokens)"
+        )
+        return _usage(data, "warmup", model)
+    except Exception as e:
+        print(f"[ollama] warm-up {model} failed: {e}")
+        return None
+
+
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+
+
+def _coalesced(key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+    """
+    Run fn() once per key at a time: concurrent callers with the same key wait
+    for the first caller's result instead of sending a duplicate request.
+    Returns (result, shared); shared results are copies.
+    """
+    with _inflight_lock:
+        fut = _inflight.get(key)
+        owner = fut is None
+        if owner:
+            fut = Future()
+            _inflight[key] = fut
+    if not owner:
+        return copy.deepcopy(fut.result()), True
+    try:
+        result = fn()
+        fut.set_result(result)
+        return result, False
+    except BaseException as e:
+        fut.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+def call_ollama_structured(
+    model: str,
+    content: str,
+    schema: Any,
+    technical: FileTechnical,
+    *,
+    timeout_s: int = 180,
+    num_predict: Optional[int] = None,
+    num_ctx: Optional[int] = None,
+    use_cache: bool = True,
+    stream: bool = False,
+    keep_alive: Optional[str] = None,
+    on_usage: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Call Ollama with a JSON schema and return a dict that conforms to that schema.
+    Fully schema-driven. No ArchiveMetadata assumptions.
+    Parsed model output is cached by (model, schema, prompt version, chunk text).
+    stream=True reads tokens incrementally, stops at the end of the root object
+    and keeps the completed fields if the timeout hits mid-generation.
+    keep_alive (e.g. "30m") keeps the model loaded between chunks and files.
+    on_usage receives token counts and timings of every model call (and cache hits).
+    Identical concurrent calls (same model, schema, options and text) share one request.
+    num_ctx/num_predict default to generation_sizes() for this chunk.
+    `schema` may be a CompiledSchema (see aggregation.compile_schema) to avoid
+    re-deriving the per-property handling for every chunk.
+    """
+    cs = compile_schema(schema)
+    if num_ctx is None or num_predict is None:
+        auto_ctx, auto_predict = generation_sizes(cs, len(content))
+        num_ctx = num_ctx or auto_ctx
+        num_predict = num_predict or auto_predict
+
+    obj, _complete = _structured_answer(
+        model,
+        cs,
+        extraction_prefix(cs),
+        content,
+        timeout_s=timeout_s,
+        num_predict=num_predict,
+        num_ctx=num_ctx,
+        use_cache=use_cache,
+        stream=stream,
+        keep_alive=keep_alive,
+        on_usage=on_usage,
+    )
+    return _with_metadata(cs.normalize(obj), cs, technical)
+
+
+def _structured_answer(
+    model: str,
+    fmt: CompiledSchema,
+    prefix: str,
+    content: str,
+    *,
+    timeout_s: int,
+    num_predict: int,
+    num_ctx: int,
+    use_cache: bool,
+    stream: bool,
+    keep_alive: Optional[str],
+    on_usage: Optional[Callable[[Dict[str, Any]], None]],
+) -> Tuple[Dict[str, Any], bool]:
+    """
+    Raw (un-normalized) model answer for prefix + content under schema `fmt`:
+    cache, coalescing, generate. Returns (answer, complete) as _generate_structured.
+    """
+    schema = fmt.schema
+    payload = {
+        "model": model,
+        "format": schema,          # Ollama schema-constrained generation
+        "prompt": prefix + content,
+        "stream": bool(stream),
+        "options": {
+            "temperature": 0.0,
+            "repeat_penalty": 1.05,
+            "top_k": 40,
+            "top_p": 0.9,
+            "num_predict": int(num_predict),
+            "num_ctx": int(num_ctx),
+        },
+    }
+    if keep_alive:
+        payload["keep_alive"] = keep_alive
+
+    key = cache_key(model, fmt.schema_json, PROMPT_VERSION, content, extra=payload["options"])
+    ckey = key if use_cache else None
+    obj = cache_get(ckey) if ckey else None
+    if obj is not None:
+        _report(on_usage, {"kind": "generate", "model": model, "cached": True})
+        return obj, True
+
+    def generate() -> Tuple[Dict[str, Any], bool]:
+        result, complete = _generate_structured(
+            model, payload, fmt, timeout_s=timeout_s, num_predict=num_predict, num_ctx=num_ctx, on_usage=on_usage
+        )
+        if ckey and result and complete:
+            cache_put(ckey, result)
+        return result, complete
+
+    # identical request already in flight (boilerplate chunks): wait for its answer
+    (obj, complete), shared = _coalesced(key, generate)
+    if shared:
+        _report(on_usage, {"kind": "coalesced", "model": model, "cached": True})
+    return obj, complete
+
+
+def _with_metadata(normalized: Dict[str, Any], cs: CompiledSchema, technical: Optional[FileTechnical]) -> Dict[str, Any]:
+    """Inject technical/filetype ONLY if the schema expects them."""
+    if cs.has_technical and not isinstance(normalized.get("technical"), dict):
         normalized["technical"] = model_to_dict(technical)
 
-    if "filetype" in props and not normalized.get("filetype"):
+    if cs.has_filetype and not normalized.get("filetype"):
         normalized["filetype"] = technical.extension.lstrip(".") if technical else None
 
     return normalized
 
 
+# -----------------------
+# Multi-document packing
+# -----------------------
+
+PACK_NOTE = (
+    "Hieronder staan meerdere korte, losse documenten. Geef voor ELK document een apart record "
+    "in \"documents\", met het doc_id van dat document.\n\n"
+)
+
+
+def _packed_schema(cs: CompiledSchema) -> CompiledSchema:
+    """Wrapper schema: {"documents": [{doc_id, ...per-document fields}]} (technical/filetype are filled locally)."""
+    props = {k: v for k, v in cs.props.items() if k not in ("technical", "filetype")}
+    return compile_schema({
+        "type": "object",
+        "properties": {
+            "documents": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {"doc_id": {"type": "string"}, **props},
+                    "required": ["doc_id"] + [k for k in cs.required if k in props],
+                },
+            },
+        },
+        "required": ["documents"],
+    })
+
+
+_PACK_HEADER_CHARS = 24   # "\n\n### doc_id: d12\n" per document
+
+
+def packed_doc_limit(schema: Any, max_chars: int, num_ctx: Optional[int] = None) -> int:
+    """
+    How many documents (max_chars of text in total) fit one packed request,
+    prompt plus one answer each, in num_ctx (default: the largest bucket).
+    """
+    cs = compile_schema(schema)
+    ctx = int(num_ctx or OLLAMA_CTX_BUCKETS[-1])
+    base = len(extraction_prefix(cs)) + len(PACK_NOTE) + int(max_chars)
+    per_doc = max(1, _output_budget(cs))
+    n = 1
+    while _estimate_tokens(base + (n + 1) * _PACK_HEADER_CHARS) + (n + 1) * per_doc + _CTX_MARGIN_TOKENS <= ctx:
+        n += 1
+    return n
+
+
+def call_ollama_packed(
+    model: str,
+    docs: List[Tuple[str, str, FileTechnical]],
+    schema: Any,
+    *,
+    timeout_s: int = 180,
+    num_ctx: Optional[int] = None,
+    use_cache: bool = True,
+    stream: bool = False,
+    keep_alive: Optional[str] = None,
+    on_usage: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Extract several small documents in one request. docs = [(doc_id, text, technical)].
+    Uses the same instruction prefix as call_ollama_structured (KV-cache reuse)
+    and a wrapper schema with one record per doc_id. Returns {doc_id: normalized
+    record} for the documents the model answered; callers handle missing ids.
+    num_ctx defaults to what the documents plus one answer per document need;
+    pass the job's num_ctx (Ollama reloads the model when it changes) and limit
+    the documents with packed_doc_limit(). The answer may use all context left
+    after the prompt. A cut-off answer keeps only the records that were
+    complete; the caller re-sends the other documents.
+    """
+    cs = compile_schema(schema)
+    wrapper = _packed_schema(cs)
+    content = PACK_NOTE + "\n\n".join(f"### doc_id: {doc_id}\n{text.strip()}" for doc_id, text, _ in docs)
+
+    prefix = extraction_prefix(cs)
+    needed = _estimate_tokens(len(prefix) + len(content))
+    per_doc = _output_budget(cs)
+    if num_ctx is None:
+        num_ctx = _bucket(needed + per_doc * len(docs) + _CTX_MARGIN_TOKENS, OLLAMA_CTX_BUCKETS)
+    # all context left after the prompt may go to the answer; generation stops at the end of the JSON
+    num_predict = max(OLLAMA_PREDICT_BUCKETS[0], int(num_ctx) - needed - _CTX_MARGIN_TOKENS)
+
+    obj, _complete = _structured_answer(
+        model,
+        wrapper,
+        prefix,
+        content,
+        timeout_s=timeout_s,
+        num_predict=num_predict,
+        num_ctx=num_ctx,
+        use_cache=use_cache,
+        stream=stream,
+        keep_alive=keep_alive,
+        on_usage=on_usage,
+    )
+
+    techs = {doc_id: tech for doc_id, _, tech in docs}
+    out: Dict[str, Dict[str, Any]] = {}
+    items = obj.get("documents") if isinstance(obj, dict) else None
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        doc_id = str(item.get("doc_id") or "").strip()
+        if doc_id in techs and doc_id not in out:
+            out[doc_id] = _with_metadata(cs.normalize(item), cs, techs[doc_id])
+    return out
+
+
+class OllamaCallPool:
+    """
+    Bounded thread pool for concurrent Ollama requests.
+    submit() blocks once `max_in_flight` calls are queued or running, so callers
+    get backpressure instead of an unbounded backlog of futures.
+    """
+
+    def __init__(self, max_in_flight: int = 1):
+        self.max_in_flight = max(1, int(max_in_flight))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="ollama")
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        self._slots.acquire()
+        try:
+            fut = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        fut.add_done_callback(lambda _f: self._slots.release())
+        return fut
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self) -> "OllamaCallPool":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.shutdown(wait=True)
+
+
+def call_ollama_structured_async(
+    pool: OllamaCallPool,
+    model: str,
+    content: str,
+    schema: Dict[str, Any],
+    technical: FileTechnical,
+    **kwargs: Any,
+) -> Future:
+    """Thread-pooled variant of call_ollama_structured; returns a Future of the normalized dict."""
+    return pool.submit(call_ollama_structured, model, content, schema, technical, **kwargs)
+
+
+SCHEMA_PROMPT_VERSION = "1"
+
+
+def _schema_cache_key(model: str, description: str) -> str:
+    # whitespace differences (re-wrapped lines, trailing spaces) don't change the schema
+    return cache_key(model, "json-schema", SCHEMA_PROMPT_VERSION, " ".join(description.split()))
+
+
+def cached_json_schema(model: str, description: str) -> Optional[Dict[str, Any]]:
+    """Previously generated schema for this description, or None (no Ollama call)."""
+    desc = (description or "").strip()
+    if not desc:
+        return None
+    obj = cache_get(_schema_cache_key(model, desc))
+    return obj if isinstance(obj, dict) and obj else None
+
+
 def generate_json_schema(
     model: str,
     description: str,
@@ -345,16 +1255,24 @@ def generate_json_schema(
     timeout_s: int = 60,
     num_predict: int = 800,
     num_ctx: int = 2048,
+    use_cache: bool = True,
 ) -> Dict[str, Any]:
     """
     Generate a JSON Schema for archival metadata extraction from a free-text description.
 
     Returns a dict JSON Schema (root object) suitable to pass as `format` to Ollama.
+    Results are cached per (model, normalized description); the DEFAULT_SCHEMA
+    fallback after a failed generation is not.
     """
     desc = (description or "").strip()
     if not desc:
         return DEFAULT_SCHEMA
 
+    ckey = _schema_cache_key(model, desc) if use_cache else None
+    cached = cache_get(ckey) if ckey else None
+    if isinstance(cached, dict) and cached:
+        return cached
+
     prompt = f"""
     Je bent een assistent die JSON Schema's maakt voor metadata-extractie door een LLM.
 
@@ -387,11 +1305,11 @@ def generate_json_schema(
     data = _ollama_generate(payload, timeout_s=int(timeout_s), retries=3)
     raw = (data.get("response") or "").strip()
 
-    # First attempt: strict parse, fallback to loose extraction
+    # First attempt: strict parse, fallback to loose extraction, then local repair
     try:
         obj = json.loads(raw) if raw else {}
     except Exception:
-        obj = _loose_json_extract(raw)
+        obj = _loose_json_extract(raw) or _repair_json(raw)
 
     # Repair attempt if invalid / empty
     if not isinstance(obj, dict) or not obj:
@@ -453,4 +1371,6 @@ def generate_json_schema(
         if "required" not in obj or not isinstance(obj.get("required"), list):
             obj["required"] = list(props.keys())
 
+    if ckey:
+        cache_put(ckey, obj)
     return obj
@@ -0,0 +1,150 @@
+from __future__ import annotations
+import math
+from typing import Any, Callable, Dict, List, Optional, Iterable
+
+from .db import find_preprocessed_file, get_preprocess_chunks, get_job, list_preprocess_job_ids
+from .ollama_client import embed_many
+
+DEFAULT_EMBED_MODEL = "qwen3-embedding:0.6b"
+
+# -----------------------
+# Vector helpers
+# -----------------------
+
+def _normalize(vec: List[float]) -> List[float]:
+    n = math.sqrt(sum(x * x for x in vec))
+    return [x / n for x in vec] if n else vec
+
+def _dot(a: List[float], b: List[float]) -> float:
+    return sum(x * y for x, y in zip(a, b))
+
+def _property_queries(schema: Dict[str, Any]) -> Dict[str, str]:
+    """One retrieval query per top-level property: its description, or just the key."""
+    props = (schema or {}).get("properties")
+    props = props if isinstance(props, dict) else {}
+    out: Dict[str, str] = {}
+    for key, ps in props.items():
+        if key in ("technical", "filetype"):
+            continue  # filled from technical metadata, not from text
+        desc = ps.get("description") if isinstance(ps, dict) else None
+        out[key] = f"{key}: {desc}" if desc else key
+    return out
+
+# -----------------------
+# Retriever
+# -----------------------
+
+class PropertyRetriever:
+    """
+    Selects, per file, the preprocessed embed chunks most similar to the schema
+    property descriptions. Query vectors are embedded once per job (per model).
+    """
+
+    def __init__(
+        self,
+        schema: Dict[str, Any],
+        *,
+        top_k: int = 3,
+        max_chunks: int = 5,
+        chunk_size: int = 2200,
+        embed_model: Optional[str] = None,
+        timeout_s: int = 60,
+        on_usage: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ):
+        self.queries = _property_queries(schema)
+        self.top_k = max(1, int(top_k))
+        self.max_chunks = max(1, int(max_chunks))
+        self.chunk_size = int(chunk_size)
+        self.embed_model = embed_model
+        self.timeout_s = int(timeout_s)
+        self.on_usage = on_usage
+        self._query_vecs: Dict[str, Dict[str, List[float]]] = {}
+        self._job_models: Dict[int, str] = {}
+
+    def _model_for(self, preprocess_job_id: int) -> str:
+        # query vectors must come from the model that embedded the chunks
+        if preprocess_job_id not in self._job_models:
+            job = get_job(preprocess_job_id) or {}
+            pre = (job.get("options") or {}).get("preprocess") or {}
+            self._job_models[preprocess_job_id] = pre.get("embed_model") or self.embed_model or DEFAULT_EMBED_MODEL
+        return self._job_models[preprocess_job_id]
+
+    def _vectors(self, model: str) -> Dict[str, List[float]]:
+        if model not in self._query_vecs:
+            keys = list(self.queries)
+            embs = embed_many([self.queries[k] for k in keys], model, timeout_s=self.timeout_s, on_usage=self.on_usage)
+            self._query_vecs[model] = {k: _normalize(v) for k, v in zip(keys, embs) if v}
+        return self._query_vecs[model]
+
+    def preprocess_models(self) -> List[str]:
+        """Embed models of all preprocess jobs, i.e. every model select_chunks may need."""
+        return list(dict.fromkeys(self._model_for(j) for j in list_preprocess_job_ids()))
+
+    def prepare(self, models: Optional[Iterable[str]] = None) -> None:
+        """
+        Embed the query vectors up front (default: the configured embed model),
+        so the embedding model isn't loaded between generation calls later on.
+        """
+        for model in models or [self.embed_model or DEFAULT_EMBED_MODEL]:
+            self._vectors(model)
+
+    def select_chunks(self, sha256: str) -> List[str]:
+        """
+        LLM inputs for a file: top-k chunks per property, restored to document
+        order and packed into at most max_chunks inputs of at most chunk_size
+        chars. Chunks are taken round-robin by rank (every property's best chunk
+        before any second-best) as long as the packed inputs stay within
+        max_chunks. Empty if the file was not preprocessed.
+        """
+        pf = find_preprocessed_file(sha256)
+        if not pf:
+            return []
+        chunks = get_preprocess_chunks(int(pf["id"]))
+        if not chunks:
+            return []
+        qvecs = self._vectors(self._model_for(int(pf["job_id"])))
+        if not qvecs:
+            return []
+
+        cvecs = [_normalize(c["embedding"]) for c in chunks]
+        ranked: List[List[int]] = []
+        for qv in qvecs.values():
+            scores = sorted(((_dot(qv, cv), i) for i, cv in enumerate(cvecs)), reverse=True)
+            ranked.append([i for _, i in scores[: self.top_k]])
+
+        picked: List[int] = []
+        packed: List[str] = []
+        for rank in range(self.top_k):
+            for r in ranked:
+                if rank >= len(r) or r[rank] in picked:
+                    continue
+                trial = _pack([chunks[i] for i in sorted(picked + [r[rank]])], self.chunk_size)
+                if len(trial) <= self.max_chunks:
+                    picked.append(r[rank])
+                    packed = trial
+        return packed
+
+
+def _pack(chunks: List[Dict[str, Any]], chunk_size: int) -> List[str]:
+    """Join selected chunks (document order) into as few inputs <= chunk_size as possible."""
+    out: List[str] = []
+    cur: List[str] = []
+    cur_len = 0
+    last_end: Optional[int] = None
+    for c in chunks:
+        text = c["chunk_text"]
+        # overlapping neighbours: drop the part already included
+        if last_end is not None and cur and c["start_char"] < last_end:
+            text = text[last_end - c["start_char"]:]
+        if cur and cur_len + len(text) > chunk_size:
+            out.append("".join(cur))
+            cur, cur_len = [], 0
+            text = c["chunk_text"]
+        elif cur and last_end is not None and c["start_char"] > last_end:
+            text = "\n[...]\n" + text
+        cur.append(text)
+        cur_len += len(text)
+        last_end = c["end_char"]
+    if cur:
+        out.append("".join(cur))
+    return out
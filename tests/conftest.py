@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# db/cache paths are derived from the home directory at import time
+os.environ["HOME"] = tempfile.mkdtemp(prefix="archiefassistent-tests-")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,52 @@
+from pathlib import Path
+
+from src.archiefassistent import jobs
+from src.archiefassistent.aggregation import compile_schema, default_stop_fields
+from src.archiefassistent.ollama_client import DEFAULT_SCHEMA
+
+
+def test_default_stop_fields_skip_fields_that_may_stay_empty():
+    fields = default_stop_fields(DEFAULT_SCHEMA)
+    assert "technical" not in fields and "filetype" not in fields
+    assert "date_end" not in fields and "sensitivity" not in fields  # nullable
+    assert "addresses" not in fields  # array: [] is a valid answer
+    assert "description" not in fields  # concat
+
+
+def test_early_stop_fires_with_default_schema(monkeypatch):
+    calls = []
+
+    def fake_call(content, schema, on_usage=None, **kwargs):
+        calls.append(content)
+        # a typical answer: technical is left to the client, nullable fields empty
+        return {
+            "title": "Inspectierapport",
+            "description": "Rapport van een bezoek.",
+            "creator": None,
+            "date_start": "2021-03-04",
+            "date_end": None,
+            "subjects": ["onderwijs"],
+            "language": "nl",
+            "addresses": [],
+            "rights": "openbaar",
+            "sensitivity": None,
+            "retention": "permanent",
+            "filetype": "txt",
+            "technical": {},
+        }
+
+    monkeypatch.setattr(jobs, "call_ollama_structured", fake_call)
+    compiled = compile_schema(DEFAULT_SCHEMA)
+    chunk_dicts = jobs._extract_until_filled(
+        1,
+        Path("a.txt"),
+        ["chunk 1", "chunk 2", "chunk 3"],
+        default_stop_fields(compiled),
+        compiled,
+        {},
+        "txt",
+        model="m",
+        technical=None,
+    )
+    assert calls == ["chunk 1"]
+    assert len(chunk_dicts) == 1
@@ -0,0 +1,32 @@
+from src.archiefassistent import ollama_client
+from src.archiefassistent.aggregation import compile_schema
+from src.archiefassistent.ollama_client import DEFAULT_SCHEMA, _generate_structured
+
+
+def _generate(monkeypatch, response):
+    monkeypatch.setattr(ollama_client, "_ollama_generate", lambda payload, timeout_s, retries=3: response)
+    payload = {"model": "m", "prompt": "tekst", "stream": False, "options": {}}
+    return _generate_structured(
+        "m", payload, compile_schema(DEFAULT_SCHEMA), timeout_s=10, num_predict=256, num_ctx=2048
+    )
+
+
+def test_value_cut_off_mid_string_is_dropped(monkeypatch):
+    raw = '{"title": "Inspectierapport", "language": "nl", "creator": "Gemeente Amst'
+    obj, complete = _generate(monkeypatch, {"response": raw, "done": True, "done_reason": "length"})
+    assert obj == {"title": "Inspectierapport", "language": "nl"}
+    assert complete is False
+
+
+def test_complete_answer_is_kept(monkeypatch):
+    raw = '{"title": "Inspectierapport", "creator": "Gemeente Amsterdam"}'
+    obj, complete = _generate(monkeypatch, {"response": raw, "done": True, "done_reason": "stop"})
+    assert obj == {"title": "Inspectierapport", "creator": "Gemeente Amsterdam"}
+    assert complete is True
+
+
+def test_packed_answer_cut_off_keeps_whole_documents():
+    raw = '{"documents": [{"doc_id": "d1", "title": "A"}, {"doc_id": "d2", "title": "B"}, {"doc_id": "d3", "title": "Hal'
+    assert ollama_client._salvage_partial_json(raw) == {
+        "documents": [{"doc_id": "d1", "title": "A"}, {"doc_id": "d2", "title": "B"}]
+    }
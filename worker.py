@@ -1,10 +1,24 @@
 # worker.py
-import time
+import os
+import socket
+import threading
 
-from src.archiefassistent.db import get_next_queued_job, update_job_status
+from src.archiefassistent.db import claim_next_job, heartbeat_job, release_job, get_job_llm_stats, set_job_result
+from src.archiefassistent.config import DEFAULT_MODEL, OLLAMA_KEEP_ALIVE
 from src.archiefassistent.jobs import process_job
+from src.archiefassistent.ollama_client import warm_up_model, loaded_models, generate_json_schema, generation_sizes, DEFAULT_SCHEMA
+from src.archiefassistent.notify import JobWaiter
 
-POLL_SECONDS = 2
+# Idle workers block on a wake-up from create_job; polling is only a fallback
+# (missed notifications, expired leases) and backs off exponentially.
+IDLE_MIN_SECONDS = 1
+IDLE_MAX_SECONDS = 30
+LEASE_SECONDS = 300
+HEARTBEAT_SECONDS = 60
+# Jobs for an already-loaded model go first (no model swap), but never make
+# another job wait longer than this.
+MODEL_AFFINITY_MAX_WAIT_SECONDS = 600
+DEFAULT_CHUNK_SIZE = 2200
 
 def _as_int(v, default):
     try:
@@ -13,37 +27,148 @@ def _as_int(v, default):
         return int(default)
 
 
+def _worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _heartbeat_loop(job_id: int, owner: str, stop: threading.Event) -> None:
+    while not stop.wait(HEARTBEAT_SECONDS):
+        try:
+            if not heartbeat_job(job_id, owner, lease_seconds=LEASE_SECONDS):
+                print(f"[worker] lost lease on job {job_id}")
+                return
+        except Exception as e:
+            print(f"[worker] heartbeat failed for job {job_id}: {e}")
+
+
+def _log_model_loads(job_id: int) -> None:
+    try:
+        stats = get_job_llm_stats(job_id)
+    except Exception:
+        return
+    if stats.get("calls"):
+        print(
+            f"[worker] job {job_id}: {stats['calls']} model calls, "
+            f"{stats.get('load_events') or 0} model loads ({stats.get('load_s') or 0:.1f}s), "
+            f"compute {stats.get('compute_s') or 0:.1f}s, waiting {stats.get('waiting_s') or 0:.1f}s"
+        )
+
+
+def _run_schema_job(job, owner: str) -> None:
+    """Generate a JSON Schema from the job's description; the page polls for the result."""
+    job_id = int(job["id"])
+    options = job.get("options") or {}
+    # retries + repair pass can outlast the lease; keep it so no other worker reclaims the job
+    stop = threading.Event()
+    hb = threading.Thread(target=_heartbeat_loop, args=(job_id, owner, stop), daemon=True)
+    hb.start()
+    try:
+        schema = generate_json_schema(
+            model=job["model_tag"],
+            description=options.get("description") or "",
+            timeout_s=_as_int(options.get("request_timeout"), 60),
+        )
+        set_job_result(job_id, schema)
+        release_job(job_id, owner, "finished")
+        print(f"[worker] generated schema for job {job_id}")
+    except Exception as e:
+        release_job(job_id, owner, f"failed: {e}")
+        print(f"[worker] schema generation failed for job {job_id}: {e}")
+    finally:
+        stop.set()
+        hb.join(timeout=5)
+
+
+def _schema_loop(owner: str) -> None:
+    """Schema jobs get their own thread, so the page doesn't wait for an extraction job to finish."""
+    waiter = JobWaiter(f"worker-{os.getpid()}-schema")
+    idle = IDLE_MIN_SECONDS
+    try:
+        while True:
+            try:
+                job = claim_next_job(owner, lease_seconds=LEASE_SECONDS, kinds=["schema"])
+            except Exception as e:
+                print(f"[worker] claiming schema job failed: {e}")
+                job = None
+            if not job:
+                woken = waiter.wait(idle)
+                idle = IDLE_MIN_SECONDS if woken else min(idle * 2, IDLE_MAX_SECONDS)
+                continue
+            idle = IDLE_MIN_SECONDS
+            _run_schema_job(job, owner)
+    finally:
+        waiter.close()
+
+
 def main():
-    print("Archiefassistent worker started.")
+    owner = _worker_id()
+    print(f"Archiefassistent worker started ({owner}).")
+    threading.Thread(target=_schema_loop, args=(owner,), daemon=True, name="schema-jobs").start()
+    # load the default model now, not on the first chunk of the first job, with the
+    # num_ctx a job with default settings uses (another num_ctx would reload it)
+    warm_up_model(DEFAULT_MODEL, keep_alive=OLLAMA_KEEP_ALIVE, num_ctx=generation_sizes(DEFAULT_SCHEMA, DEFAULT_CHUNK_SIZE)[0])
+    waiter = JobWaiter(f"worker-{os.getpid()}")
+    idle = IDLE_MIN_SECONDS
+    last_model = DEFAULT_MODEL
     try:
         while True:
-            job = get_next_queued_job()
+            resident = loaded_models() or [last_model]
+            job = claim_next_job(
+                owner,
+                lease_seconds=LEASE_SECONDS,
+                prefer_models=resident,
+                max_wait_s=MODEL_AFFINITY_MAX_WAIT_SECONDS,
+                kinds=["extract"],
+            )
             if not job:
-                time.sleep(POLL_SECONDS)
+                woken = waiter.wait(idle)
+                idle = IDLE_MIN_SECONDS if woken else min(idle * 2, IDLE_MAX_SECONDS)
                 continue
+            idle = IDLE_MIN_SECONDS
 
             job_id = int(job["id"])
-            update_job_status(job_id, "running")
             print(f"[worker] running job {job_id}: {job.get('name')}")
             options = job.get("options") or {}
 
             timeout_s = _as_int(options.get("request_timeout"), 180)
-            chunk_size = _as_int(options.get("chunk_size"), 2200)
+            chunk_size = _as_int(options.get("chunk_size"), DEFAULT_CHUNK_SIZE)
             chunk_overlap = _as_int(options.get("chunk_overlap"), 150)
             max_chunks = _as_int(options.get("max_chunks"), 5)
             max_files = _as_int(options.get("max_files"), 200)
+            extract_workers = _as_int(options.get("extract_workers"), 1)
+            llm_concurrency = _as_int(options.get("llm_concurrency"), 1)
+            extraction_mode = options.get("extraction_mode") or "chunks"
+            retrieval_top_k = _as_int(options.get("retrieval_top_k"), 3)
+            early_stop = bool(options.get("early_stop"))
+            early_stop_fields = options.get("early_stop_fields") or None
+            stream = bool(options.get("stream"))
+            keep_alive = options.get("keep_alive") or OLLAMA_KEEP_ALIVE
+            escalation_model = options.get("escalation_model") or None
+            escalation_must_fill = options.get("escalation_must_fill")
+            pack_max_chars = _as_int(options.get("pack_max_chars"), 0)
+            pack_max_docs = _as_int(options.get("pack_max_docs"), 6)
             schema = options.get("schema")
 
+            stop = threading.Event()
+            hb = threading.Thread(target=_heartbeat_loop, args=(job_id, owner, stop), daemon=True)
+            hb.start()
             try:
-                process_job(job_id, job["root_dir"], job["model_tag"], timeout_s=timeout_s, chunk_size=chunk_size, chunk_overlap=chunk_overlap, max_chunks=max_chunks, max_files=max_files, schema=schema)
-                update_job_status(job_id, "finished")
+                process_job(job_id, job["root_dir"], job["model_tag"], timeout_s=timeout_s, chunk_size=chunk_size, chunk_overlap=chunk_overlap, max_chunks=max_chunks, max_files=max_files, schema=schema, extract_workers=extract_workers, llm_concurrency=llm_concurrency, extraction_mode=extraction_mode, retrieval_top_k=retrieval_top_k, early_stop=early_stop, early_stop_fields=early_stop_fields, stream=stream, keep_alive=keep_alive, escalation_model=escalation_model, escalation_must_fill=escalation_must_fill, pack_max_chars=pack_max_chars, pack_max_docs=pack_max_docs)
+                release_job(job_id, owner, "finished")
                 print(f"[worker] finished job {job_id}")
+                last_model = job["model_tag"]
             except Exception as e:
-                update_job_status(job_id, f"failed: {e}")
+                release_job(job_id, owner, f"failed: {e}")
                 print(f"[worker] failed job {job_id}: {e}")
+            finally:
+                stop.set()
+                hb.join(timeout=5)
+                _log_model_loads(job_id)
 
     except KeyboardInterrupt:
         print("\n[worker] stopping (Ctrl+C)")
+    finally:
+        waiter.close()
 
 
 if __name__ == "__main__":